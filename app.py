@@ -1,18 +1,26 @@
-
 # standard
+import codecs
+import contextlib
+import csv
+import functools
+import io
 import logging
-import os
-import requests
-from requests.exceptions import MissingSchema, ConnectionError, HTTPError
 import sqlite3
+import threading
+import time
+from typing import Iterator
 # external
 import flask
 # local
 import iris
+import jobs
 import log
+from settings import parse_bool, Settings
 import sql_operations
+import sync
 
 # Uncomment for running on host (not Docker)
+# import os
 # os.environ["SQL_PATH"] = "./iris.sql"
 # os.environ["DEFAULT_IRIS_DATA_URL"] = "https://gist.githubusercontent.com/curran/" \
 #                                       "a08a1080b88344b0c8a7/raw/0e7a9b0a5d22642a06d3d5b9bcbad9890c8ee534/iris.csv"
@@ -23,40 +31,116 @@ import sql_operations
 # os.environ["FLASK_DEBUG_MODE"] = "0"
 # os.environ["LOG_INDICATOR"] = "rabbitofcaerbannog"
 
+NDJSON_MIMETYPE = "application/x-ndjson"                     # Newline delimited json
+BINARY_MIMETYPE = "application/x-iris-binary"                # Columnar binary format, see iris.BinaryColumnsEncoder
+# Formats of GET /iris responses: {"format" parameter value: mimetype}. First one is the default
+EXPORT_MIMETYPES = {"json": "application/json", "ndjson": NDJSON_MIMETYPE, "csv": "text/csv", "binary": BINARY_MIMETYPE}
+BINARY_BATCH_SIZE = 8192                                     # Rows per batch in binary format
+READ_SIZE = 64 * 1024                                        # Bytes to read from request stream at a time
 
-###############
-# Set logging #
-###############
-
-logger_name = os.getenv("LOGGER_NAME", "root")                         # Use only names that can also be folder names.
-log_level = os.getenv("LOG_LEVEL", "INFO").upper()
-log_indicator = os.environ.get("LOG_INDICATOR", str())    # Unique sequence to indicate where to split syslog entries.
-logger = log.setup_logger(logger_name, log_level, log_indicator)
-
+# Endpoints. Registered on each app by create_app
+routes = flask.Blueprint("iris_api", __name__)
 
-###############
-# Setup Flask #
-###############
 
-app = flask.Flask(__name__)
+#############
+# App state #
+#############
 
-# Add handlers to Flask loggers
-# Flask uses a logger by the app name and an inherited 'werkzeug' logger
-flask_loggers = [app.name, "werkzeug"]
-for flask_logger_name in flask_loggers:
-    flask_logger = logging.getLogger(flask_logger_name)
-    flask_logger.handlers.clear()
-    flask_logger.addHandler(logger.handlers[0])
-    flask_logger.setLevel(log_level)
+class IrisApi:
+    """
+    Objects shared by all requests of an app: database connection pool, caches, background jobs
+    and the http session for syncs. Created by create_app and stored in app.extensions (see get_iris_api).
+    Nothing is opened or started here: connections, job threads and the http session are created on first use.
+    Servers should call close before exiting (see gunicorn.conf.py). Apps that are just dropped, e.g. in tests,
+    are not kept alive by it.
+
+    Instance attributes:
+    settings: Settings object
+    logger: Logger of the app. See log.setup_logger
+    connection_pool: sql_operations.ConnectionPool shared by all requests.
+    Iris table is created once, when the first connection is borrowed.
+    summary_cache: Summary of stored data, kept up to date by inserts in this process
+    write_queue: Inserts from POST requests and syncs, written by a single writer thread with group commits
+    result_cache: Serialized results of GET /iris requests, valid until the table changes
+    query_advisor: Optional logging of where-column usage and query plans of slow filters, to help decide which
+    indexes to keep. None if not enabled
+    host_limiter: Limits the number of simultaneous downloads per host for all syncs of the app
+    job_manager: Background jobs, e.g. syncs started with "background=1"
+    startup_seconds: Time spent in create_app
+    """
 
-app.config["DEBUG"] = bool(int(os.environ.get("FLASK_DEBUG_MODE", 0)))
+    def __init__(self, settings: Settings) -> None:
+        self.settings = settings
+        self.logger = log.setup_logger(
+            settings.logger_name,
+            settings.log_level,
+            settings.log_indicator,
+            queue_size=settings.log_queue_size)
+        self.connection_pool = sql_operations.ConnectionPool(
+            path=settings.sql_path,
+            pragmas=settings.sql_pragmas,
+            max_connections=settings.sql_max_connections,
+            bootstrap=functools.partial(
+                sql_operations.SqlIrisInterface.bootstrap, indexed_columns=list(settings.sql_indexed_columns)))
+        self.summary_cache = sql_operations.SummaryCache(columns=sql_operations.SqlIrisInterface.columns_python_types)
+        self.write_queue = sql_operations.WriteQueue(
+            connection_pool=self.connection_pool,
+            get_table=self.get_iris_table,
+            max_transaction_rows=settings.sql_group_commit_rows,
+            chunk_size=settings.sql_insert_chunk_size,
+            max_queued_batches=settings.sql_write_queue_size)
+        self.result_cache = sql_operations.QueryResultCache(
+            max_entries=settings.result_cache_size,
+            ttl_seconds=settings.result_cache_ttl,
+            max_entry_bytes=settings.result_cache_max_entry_bytes)
+        self.query_advisor = None
+        if settings.query_advisor:
+            self.query_advisor = sql_operations.QueryAdvisor(slow_query_seconds=settings.slow_query_seconds)
+        self.host_limiter = sync.HostLimiter(max_per_host=settings.sync_max_downloads_per_host)
+        self.job_manager = jobs.JobManager(max_workers=settings.job_workers)
+        self.startup_seconds = None
+        self._http_session = None
+        self._http_session_lock = threading.Lock()
+
+    @property
+    def http_session(self):
+        """
+        requests Session for syncs. Connections to sources are kept open between syncs.
+        Created on the first sync, so that requests isn't imported while the app starts.
+        """
+        with self._http_session_lock:
+            if self._http_session is None:
+                self._http_session = sync.create_session()
+            return self._http_session
+
+    def get_iris_table(self, sql_connection: sqlite3.Connection) -> sql_operations.SqlIrisInterface:
+        """Get Iris table interface for a pooled connection. Table is already created by the pool."""
+        return sql_operations.SqlIrisInterface(
+            connection=sql_connection,
+            create=False,
+            summary_cache=self.summary_cache,
+            query_advisor=self.query_advisor)
+
+    def close(self) -> None:
+        """Wait for background jobs and queued writes, then close idle database connections and the http session."""
+        self.job_manager.shutdown()
+        self.write_queue.close()
+        self.connection_pool.close()
+        with self._http_session_lock:
+            if self._http_session is not None:
+                self._http_session.close()
+
+
+def get_iris_api() -> IrisApi:
+    """IrisApi object of the app that handles the current request."""
+    return flask.current_app.extensions["iris_api"]
 
 
 ###################
 # Flask endpoints #
 ###################
 
-@app.route("/", methods=["GET"])
+@routes.route("/", methods=["GET"])
 def home():
     """Root endpoint with api info."""
     info = """\
@@ -67,16 +151,20 @@ def home():
     <h3>GET:</h3>
     <p>/iris &emsp; - query stored data. Use 'where' parameter for filtering.</p>
     <p>/iris/all &emsp; - get all stored data.</p>
-    <p>/iris/sync &emsp; - insert iris csv from url specified in 'url' parameter. Inserts only non-existing rows.</p>
+    <p>/iris/sync &emsp; - insert iris csv from url specified in 'url' parameter. Inserts only non-existing rows. Unchanged data is not parsed again. Use 'background=1' to run as a background job.</p>
+    <p>/iris/sync/jobs/&lt;id&gt; &emsp; - get status of a background sync job.</p>
+    <p>/jobs/&lt;id&gt; &emsp; - get status of a background job (sync or delete).</p>
     <p>/iris/summary &emsp; - get per-column summary of stored data.</p>
+    <p>/stats &emsp; - get internal counters of the API process, e.g. number of dropped log records.</p>
     </br>
     <h3>POST:</h3>
-    <p>/iris &emsp; - add data. Use Content-Type "text/csv" for csv, otherwise "application/json".</p>
+    <p>/iris &emsp; - add data. Use Content-Type "text/csv" for csv, "application/x-ndjson" for newline delimited json, otherwise "application/json".</p>
     <p>/iris/unique &emsp; - add data. Adds only rows that don't already exist in storage.</p>
     </br>
     <h3>DELETE:</h3>
     <p>/iris &emsp; - delete stored data. Use 'where' parameter for specifying rows, otherwise no action.</p>
     <p>/iris/all &emsp; - delete all stored data.</p>
+    <p>Use 'chunked=1' to delete in short transactions of 'chunk_size' rows, 'background=1' to run as a background job.</p>
     </br>
     <h2>Using 'where' statement:</h2>
     <p>Available operators: =, !=, <, >, IN </p>
@@ -88,30 +176,196 @@ def home():
     <p>GET /iris?where=petal_width<1</p>
     <p>DELETE /iris?where=species%20IN%20(virginica,setosa)</p>
     <p>GET /iris?where=sepal_width>3.3&where=species%20IN%20(virginica,setosa)</p>
+    </br>
+    <h2>Pagination and streaming (GET /iris, /iris/all):</h2>
+    <p>limit &emsp; - maximum number of rows to return.</p>
+    <p>after &emsp; - return rows after the cursor from the X-Next-Cursor header of the previous page.</p>
+    <p>fields &emsp; - comma-separated columns to return.</p>
+    <p>stream=1 &emsp; - stream the response.</p>
+    <p>format &emsp; - response format: json (default), ndjson, csv or binary (columnar, see README). Can also be chosen by Accept header.</p>
+    <p>Responses that aren't streamed have an ETag header. Use 'If-None-Match' to get 304 Not Modified if the result hasn't changed.</p>
     """
     return info
 
 
-@app.route("/api/v1/iris", methods=["GET"])
-@app.route("/api/v1/iris/all", methods=["GET"])
+def parse_page_arguments(arguments: dict) -> tuple:
+    """
+    Parse pagination and column selection parameters of a GET request.
+    :param arguments: Request arguments in the form {argument name: [values]}
+    :return: A tuple (limit, after, fields). Values are None if not given.
+    """
+    limit = int(arguments["limit"][0]) if "limit" in arguments else None
+    after = int(arguments["after"][0]) if "after" in arguments else None
+    if limit is not None and limit < 1:
+        raise ValueError(f"Parameter 'limit' has to be a positive integer. Received: {limit}")
+    fields = None
+    if "fields" in arguments:
+        fields = [field.strip() for field in ",".join(arguments["fields"]).split(",") if field.strip()]
+        fields = list(dict.fromkeys(fields))            # Duplicate columns would give duplicate json keys
+    return limit, after, fields
+
+
+def stream_json_rows(cursor: sqlite3.Cursor, ndjson: bool = False, batch_size: int = 1000) -> Iterator[str]:
+    """
+    Serialize rows from an executed SQLite cursor to json incrementally.
+    Rows are fetched in batches, so that memory use doesn't depend on the number of rows.
+    Row tuples are serialized directly (see iris.get_json_row_encoder). Output is the same as flask.jsonify
+    of the rows as Iris dicts (with debug mode off).
+    :param cursor: Executed sqlite3 Cursor object
+    :param ndjson: Output newline delimited json objects instead of a json array
+    :param batch_size: Number of rows to fetch from the cursor at a time
+    :return: Iterator of json strings
+    """
+    encode_row = iris.get_json_row_encoder([item[0] for item in cursor.description])
+    # Json array: [row,row,...]\n    NDJSON: row\nrow\n...
+    opening, separator, closing = (str(), "\n", "\n") if ndjson else ("[", ",", "]\n")
+    yield opening
+    n_batches = 0
+    while batch := cursor.fetchmany(batch_size):
+        yield (separator if n_batches else str()) + separator.join([encode_row(row) for row in batch])
+        n_batches += 1
+    if n_batches or not ndjson:
+        yield closing
+
+
+def stream_csv_rows(cursor: sqlite3.Cursor, batch_size: int = 1000) -> Iterator[str]:
+    """
+    Serialize rows from an executed SQLite cursor to csv incrementally, with a header row.
+    Values are typecast like in Iris. Format is the same as in IrisBatch.to_csv, so it can be posted back.
+    :param cursor: Executed sqlite3 Cursor object
+    :param batch_size: Number of rows to fetch from the cursor at a time
+    :return: Iterator of csv strings
+    """
+    columns = [item[0] for item in cursor.description]
+    typecast_row = iris.get_row_typecaster(columns)
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerow(columns)
+    while batch := cursor.fetchmany(batch_size):
+        writer.writerows([typecast_row(row) for row in batch])
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+    if output.tell():                               # Only header if there are no rows
+        yield output.getvalue()
+
+
+def stream_binary_batches(cursor: sqlite3.Cursor, batch_size: int = BINARY_BATCH_SIZE) -> Iterator[bytes]:
+    """
+    Serialize rows from an executed SQLite cursor to the columnar binary format incrementally.
+    See iris.BinaryColumnsEncoder for the layout.
+    :param cursor: Executed sqlite3 Cursor object
+    :param batch_size: Number of rows per batch
+    :return: Iterator of bytes: header, batches and end marker
+    """
+    encoder = iris.BinaryColumnsEncoder([item[0] for item in cursor.description])
+    yield encoder.header()
+    while batch := cursor.fetchmany(batch_size):
+        yield encoder.encode_batch(batch)
+    yield encoder.end()
+
+
+def get_export_format(request: flask.request) -> str:
+    """
+    Get format for GET /iris response: the "format" parameter, or the best match for the Accept header.
+    Raises ValueError for unknown "format" values.
+    :param request: flask request object
+    :return: Key of EXPORT_MIMETYPES
+    """
+    export_format = request.args.get("format")
+    if export_format is None:
+        default_mimetype = EXPORT_MIMETYPES["json"]
+        mimetype = request.accept_mimetypes.best_match(list(EXPORT_MIMETYPES.values()), default=default_mimetype)
+        return next(name for name, export_mimetype in EXPORT_MIMETYPES.items() if export_mimetype == mimetype)
+    export_format = export_format.strip().lower()
+    if export_format not in EXPORT_MIMETYPES:
+        raise ValueError(f"Unknown format: {export_format}. Available formats: {', '.join(EXPORT_MIMETYPES)}")
+    return export_format
+
+
+def get_result_cache_key(sql_iris_table: sql_operations.SqlIrisInterface, where: (list[str] | None),
+                         fields: (list[str] | None), after: (int | None), limit: (int | None)) -> tuple:
+    """
+    Normalized query for the result cache, so that equivalent requests share a cached result.
+    "where"-statements are compiled in sorted order (they are joined by AND) and fields are sorted
+    (json keys are sorted anyway).
+    Raises ValueError if the statements can't be parsed.
+    :return: Hashable tuple
+    """
+    compiled_where = sql_iris_table.parse_where(sorted(statement.strip() for statement in where or list()))
+    fields = tuple(sorted(set(fields))) if fields else None
+    return sql_iris_table.name, compiled_where, fields, after, limit
+
+
+@routes.route("/api/v1/iris", methods=["GET"])
+@routes.route("/api/v1/iris/all", methods=["GET"])
 def get_iris():
     """
     Query stored data. Use "where" parameter for filtering.
     If no "where" parameter is supplied, returns all data.
     If accessed via /iris/all endpoint, returns all data.
+    Use "limit" and "after" parameters for pagination. The "after" value for the next page is in the
+    X-Next-Cursor response header. Use "fields" parameter to select columns, e.g. fields=species,petal_width
+    Response format is chosen by "format" parameter (json, ndjson, csv, binary) or Accept header, json by default.
+    Formats other than json are streamed, json only if "stream" parameter is set.
+    Json responses that aren't streamed are cached per table version (see get_result_cache_key) and have an ETag header.
     """
+    iris_api = get_iris_api()
     arguments = flask.request.args.to_dict(flat=False)            # Can parse several arguments with same name
     get_all = "iris/all" in str(flask.request.url_rule).lower()       # Determine if the /all endpoint is used
     where = None if get_all else arguments.get("where", None)
 
-    iris_sql_path = os.getenv("SQL_PATH", "/iris_data/iris_sql")
     try:
-        sql_connection = sql_operations.get_connection(iris_sql_path)
-        sql_iris_table = sql_operations.SqlIrisInterface(connection=sql_connection)
-        data = [row.as_dict() for row in sql_iris_table.select_iris(where=where)]
-        return flask.jsonify(data)
+        export_format = get_export_format(flask.request)
+        stream = export_format != "json" or parse_bool(flask.request.args.get("stream", "0"))
+        limit, after, fields = parse_page_arguments(arguments)
+        if stream:
+            # Connection is kept until the whole response is sent
+            sql_connection = iris_api.connection_pool.acquire()
+            try:
+                sql_iris_table = iris_api.get_iris_table(sql_connection)
+                # Page and next cursor are read from the same snapshot. Read transaction ends when the connection
+                # is released
+                sql_operations.begin_read(sql_connection)
+                next_cursor = sql_iris_table.page_end(where=where, after=after, limit=limit)
+                cursor = sql_iris_table.select_cursor(where=where, columns=fields, after=after, limit=limit)
+            except BaseException:
+                iris_api.connection_pool.release(sql_connection)
+                raise
+            if export_format == "csv":
+                chunks = stream_csv_rows(cursor)
+            elif export_format == "binary":
+                chunks = stream_binary_batches(cursor)
+            else:
+                chunks = stream_json_rows(cursor, ndjson=export_format == "ndjson")
+            response = flask.Response(chunks, mimetype=EXPORT_MIMETYPES[export_format])
+            response.call_on_close(lambda: iris_api.connection_pool.release(sql_connection))
+        else:
+            with iris_api.connection_pool.connection() as sql_connection:
+                sql_iris_table = iris_api.get_iris_table(sql_connection)
+                sql_iris_table.check_columns(fields)
+                cache_key = get_result_cache_key(sql_iris_table, where=where, fields=fields, after=after, limit=limit)
+                sql_operations.begin_read(sql_connection)   # Version, page and next cursor from the same snapshot
+                version = sql_iris_table.version()          # Read before the query, see QueryResultCache.put
+                result = iris_api.result_cache.get(cache_key, version)
+                if result is None:
+                    cursor = sql_iris_table.select_cursor(where=where, columns=fields, after=after, limit=limit)
+                    result = iris_api.result_cache.put(
+                        cache_key,
+                        version=version,
+                        body="".join(stream_json_rows(cursor)).encode(),
+                        next_cursor=sql_iris_table.page_end(where=where, after=after, limit=limit))
+            next_cursor = result.next_cursor
+            response = flask.Response(result.body, mimetype="application/json")
+            # Clients can revalidate with If-None-Match and get 304 Not Modified if the result hasn't changed
+            response.set_etag(result.etag)
+            response.cache_control.no_cache = True
+            response.make_conditional(flask.request)
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = str(next_cursor)
+        return response
     except sqlite3.Error as database_error:
-        log_entry = log.SqlConnectError(database_error, database_path=iris_sql_path)
+        log_entry = log.SqlConnectError(database_error, database_path=iris_api.settings.sql_path)
         log_entry.record("ERROR")
         return flask.make_response(log_entry.short, 500)
     except ValueError as bad_syntax_error:
@@ -120,139 +374,374 @@ def get_iris():
         return flask.make_response(log_entry.short, 400)
 
 
-def parse_post_data(request: flask.request) -> list[iris.Iris]:
+def parse_post_data(request: flask.request, batch_size: int) -> Iterator[iris.IrisBatch]:
     """
-    Parses the payload from a post request, determines whether it's csv or json.
-    Typecasts it to Iris data type
+    Parses the payload from a post request, determines whether it's csv, newline delimited json or json.
+    Typecasts it to Iris data type.
+    Payload is parsed incrementally from the request stream, so that the whole upload is never held in memory.
     :param request: flask request object from an incoming post request
-    :return: list of parsed Iris objects
+    :param batch_size: Number of rows per batch
+    :return: Iterator of IrisBatch objects with parsed rows
     """
-    if request.content_type.lower() == "text/csv":
-        payload = request.get_data().decode()
-        iris_data = iris.from_csv(payload)
-    else:
-        payload = request.get_json()
-        payload = [payload] if not isinstance(payload, list) else payload   # Accepts both list and single rows
-        iris_data = iris.from_json(payload)
-    return iris_data
-
-
-@app.route("/api/v1/iris", methods=["POST"])
-@app.route("/api/v1/iris/unique", methods=["POST"])
-def post_iris(iris_data: list[iris.Iris] = None, unique: bool = False):
+    charset = request.mimetype_params.get("charset", "utf-8")
+    # Request stream only has read() under some WSGI servers (e.g. gunicorn), so it's decoded chunk by chunk
+    chunks = codecs.iterdecode(iter(functools.partial(request.stream.read, READ_SIZE), bytes()), charset)
+    if request.mimetype == "text/csv":
+        yield from iris.iter_csv_batches(iris.split_lines(chunks), batch_size=batch_size)
+    elif request.mimetype == NDJSON_MIMETYPE:
+        yield from iris.iter_ndjson_batches(iris.split_lines(chunks), batch_size=batch_size)
+    else:                               # Accepts both a json list and a single row
+        yield from iris.iter_json_batches(chunks, batch_size=batch_size)
+
+
+@routes.route("/api/v1/iris", methods=["POST"])
+@routes.route("/api/v1/iris/unique", methods=["POST"])
+def post_iris(iris_data: iris.IrisBatch = None, unique: bool = False):
     """
     Inserts csv or json data (depending on Content-Type header) to storage
+    Data is inserted batch by batch while the request is read, so rows are committed before the upload finishes.
+    Batches are written by the write queue of the app, together with batches from other requests (group commit).
+    Response is sent after the rows are committed.
     :return: String with number of inserted rows.
     """
-    if not iris_data:                                                    # Case when endpoint request is used
+    iris_api = get_iris_api()
+    if iris_data is None:                                                # Case when endpoint request is used
         unique = "iris/unique" in str(flask.request.url_rule).lower()    # Determine if the /unique endpoint is used
-        iris_data = parse_post_data(flask.request)
-    iris_sql_path = os.getenv("SQL_PATH", "./iris.sql")
+        iris_batches = parse_post_data(flask.request, batch_size=iris_api.settings.sql_insert_chunk_size)
+    else:
+        iris_batches = [iris_data]
+    n_rows_inserted = 0
     try:
-        sql_connection = sql_operations.get_connection(iris_sql_path)
+        for iris_batch in iris_batches:
+            n_rows_inserted += iris_api.write_queue.submit(iris_batch, unique=unique).result()
     except sqlite3.Error as database_error:
-        log_entry = log.SqlConnectError(database_error, database_path=iris_sql_path)
+        log_entry = log.SqlConnectError(database_error, database_path=iris_api.settings.sql_path)
         log_entry.record("ERROR")
         return flask.make_response(log_entry.short, 500)
-    sql_iris_table = sql_operations.SqlIrisInterface(connection=sql_connection)
-    n_rows_inserted = sql_iris_table.insert_iris(data=iris_data, unique=unique)
+    except (ValueError, UnicodeDecodeError) as parse_error:
+        log_entry = log.PostDataError(parse_error, n_rows_inserted=n_rows_inserted)
+        log_entry.record("ERROR")
+        return flask.make_response(log_entry.short, 400)
     return f"Inserted {n_rows_inserted} rows."
 
 
-@app.route("/api/v1/iris", methods=["Delete"])
-@app.route("/api/v1/iris/all", methods=["Delete"])
+@routes.route("/api/v1/iris", methods=["Delete"])
+@routes.route("/api/v1/iris/all", methods=["Delete"])
 def delete_iris():
     """
     Delete rows from storage. Rows can be specified by "where" parameters.
     No action, if no "where" parameters are supplied.
     If /all endpoint is used, deletes all rows in table.
+    If "chunked" parameter is 1, rows are deleted in chunks of "chunk_size" rows (env variable SQL_DELETE_CHUNK_SIZE
+    by default), each in a short transaction, so that other writers aren't blocked for the whole delete.
+    If "background" parameter is 1, chunked delete is run as a background job. Same deletes share a job.
     :return: String with information about the number of deleted rows.
+    In background mode, job status (see get_job) with code 202.
     """
+    iris_api = get_iris_api()
     delete_all = "iris/all" in str(flask.request.url_rule).lower()        # Determine if the /all endpoint is used
     arguments = flask.request.args.to_dict(flat=False)
-    # Always true if delete_all, always false if no "where" argument
-    where = "1=1" if delete_all else arguments.get("where", "1=0")
+    # Delete everything if delete_all, nothing if no "where" argument
+    where = True if delete_all else arguments.get("where", 0)
 
-    iris_sql_path = os.getenv("SQL_PATH", "./iris.sql")
     try:
-        sql_connection = sql_operations.get_connection(iris_sql_path)
+        background = parse_bool(flask.request.args.get("background", "0"))
+        chunked = background or parse_bool(flask.request.args.get("chunked", "0"))
+        chunk_size = int(flask.request.args.get("chunk_size", iris_api.settings.sql_delete_chunk_size))
+        if chunk_size < 1:
+            raise ValueError(f"Parameter 'chunk_size' has to be a positive integer. Received: {chunk_size}")
+        if background:
+            with iris_api.connection_pool.connection() as sql_connection:
+                iris_api.get_iris_table(sql_connection).parse_where(where if where is not True else None)
+            stats = sql_operations.DeleteStats()
+            job = iris_api.job_manager.submit(
+                key="delete all" if where is True else f"delete where {' AND '.join(sorted(where or list()))}",
+                function=functools.partial(delete_iris_chunked, iris_api, where, chunk_size, stats),
+                progress=stats)
+            response = flask.make_response(flask.jsonify(job.as_dict()), 202)
+            response.headers["Location"] = flask.url_for("iris_api.get_job", job_id=job.id)
+            return response
+        if chunked:
+            n_deleted_rows = delete_iris_chunked(iris_api, where, chunk_size)
+        else:
+            with iris_api.connection_pool.connection() as sql_connection:
+                sql_iris_table = iris_api.get_iris_table(sql_connection)
+                n_deleted_rows = sql_iris_table.delete(where=where)
+        return f"Deleted {n_deleted_rows} rows"
     except sqlite3.Error as database_error:
-        log_entry = log.SqlConnectError(database_error, database_path=iris_sql_path)
+        log_entry = log.SqlConnectError(database_error, database_path=iris_api.settings.sql_path)
         log_entry.record("ERROR")
         return flask.make_response(log_entry.short, 500)
-    sql_iris_table = sql_operations.SqlIrisInterface(connection=sql_connection)
-    try:
-        n_deleted_rows = sql_iris_table.delete(where=where)
-        return f"Deleted {n_deleted_rows} rows"
     except ValueError as bad_syntax_error:
         log_entry = log.SqlDeleteError(bad_syntax_error)
         log_entry.record("ERROR")
         return flask.make_response(log_entry.short, 400)
 
 
-def download_url_data(url: str) -> str:
+def delete_iris_chunked(iris_api: IrisApi, where: (list[str] | bool), chunk_size: int,
+                        stats: sql_operations.DeleteStats = None) -> int:
     """
-    Helper function for downloading text data.
-    :param url: Data url
-    :return: Data string
+    Delete rows in chunks, each in its own transaction (see SqlTableInterface.delete_chunked).
+    Runs outside of requests in background jobs, so the app is given as iris_api.
+    :param iris_api: IrisApi object of the app
+    :param where: "where"-statements, or True to delete all rows
+    :param chunk_size: Number of rows to delete per transaction
+    :param stats: DeleteStats object to update with progress
+    :return: Number of rows deleted
     """
-    response = requests.get(url)
-    if not response:
-        raise requests.HTTPError(f"{response.status_code} ({response.reason}). url: {url}.")
-    return response.text
+    with iris_api.connection_pool.connection() as sql_connection:
+        sql_iris_table = iris_api.get_iris_table(sql_connection)
+        return sql_iris_table.delete_chunked(where=where, chunk_size=chunk_size, stats=stats)
 
 
-@app.route("/api/v1/iris/sync", methods=["GET"])
+def iter_url_batches(iris_api: IrisApi, iris_data_url: str, sync_source: (dict | None), stats: sync.SyncStats,
+                     downloads: dict) -> Iterator[iris.IrisBatch]:
+    """
+    Download and parse iris csv data from url, unless it hasn't changed since the last sync. Runs in a download thread.
+    :param iris_api: IrisApi object of the app
+    :param iris_data_url: Data url
+    :param sync_source: State of the last sync from the url. See sql_operations.get_sync_source
+    :param stats: SyncStats object to update with download and parse counters
+    :param downloads: Dict that the Download object is added to, under the url
+    :return: Iterator of IrisBatch objects
+    """
+    response = sync.request_if_changed(iris_data_url, session=iris_api.http_session, sync_source=sync_source)
+    if response is None:
+        return
+    with response:
+        downloads[iris_data_url] = download = sync.Download(response, stats)
+        yield from sync.iter_csv_download(download, batch_size=iris_api.settings.sql_insert_chunk_size)
+
+
+def get_sync_error(exception: Exception, iris_data_url: str) -> tuple[log.LogString, int]:
+    """Log entry and http status code for an exception raised while syncing data from url."""
+    from requests.exceptions import HTTPError, RequestException        # Already imported by the sync
+    if isinstance(exception, HTTPError):
+        return log.DownloadError(exception), 500
+    if isinstance(exception, RequestException):
+        return log.UrlError(exception, iris_data_url), 400
+    if isinstance(exception, (ValueError, UnicodeDecodeError)):
+        return log.PostDataError(exception, n_rows_inserted=0), 400
+    return log.DownloadError(exception), 500
+
+
+def sync_urls(iris_api: IrisApi, iris_data_urls: list[str], stats: dict[str, sync.SyncStats]) -> dict[str, Exception]:
+    """
+    Sync iris csv data from several urls at the same time. Inserts only non-existing (unique) data.
+    Data from an url is only downloaded and parsed if it has changed since the last sync from the url.
+    Downloads are streamed and parsed on a thread pool, with a limit per host (see sync.fetch_concurrently).
+    Parsed batches from all urls are inserted through the write queue of the app, together with batches from
+    POST requests and other syncs (group commit), so that the write lock isn't held while waiting for slow sources.
+    No database connection is held during downloads.
+    Sync state of successfully synced urls is saved in a final short transaction. If an url fails, rows already
+    inserted from it are kept, but its sync state isn't saved, so that the next sync downloads it again.
+    Inserts are unique, so inserting the same rows again has no effect.
+    If rows were deleted during the sync, sync state isn't saved either (see sql_operations.clear_sync_sources).
+    Runs outside of requests in background jobs, so the app is given as iris_api.
+    :param iris_api: IrisApi object of the app
+    :param iris_data_urls: Data urls
+    :param stats: {url: SyncStats} to update with progress counters and timings of each url
+    :return: {url: exception} for urls that failed
+    """
+    started = time.perf_counter()
+    downloads = dict()                  # {url: sync.Download}, added by download threads
+    errors = dict()
+    finished_urls = list()              # Urls that were downloaded and inserted completely
+    with iris_api.connection_pool.connection() as sql_connection:
+        sync_sources_version = sql_operations.get_sync_sources_version(sql_connection)
+        sync_sources = {url: sql_operations.get_sync_source(url, sql_connection) for url in iris_data_urls}
+    producers = {
+        url: functools.partial(iter_url_batches, iris_api, url, sync_sources[url], stats[url], downloads)
+        for url in iris_data_urls}
+    events = sync.fetch_concurrently(
+        producers,
+        host_limiter=iris_api.host_limiter,
+        max_workers=iris_api.settings.sync_max_downloads)
+    with contextlib.closing(events):
+        for url, iris_batch, exception in events:
+            if iris_batch is not None:
+                insert_started = time.perf_counter()            # Includes waiting in the write queue
+                stats[url].n_rows_inserted += iris_api.write_queue.submit(iris_batch, unique=True).result()
+                stats[url].insert_seconds += time.perf_counter() - insert_started
+            elif exception is not None:
+                errors[url] = exception
+                log_entry, _ = get_sync_error(exception, url)
+                log_entry.record("ERROR")
+                stats[url].error = log_entry.short
+            elif url in downloads:                              # Not in downloads if the source wasn't modified
+                finished_urls += [url]
+    if finished_urls:
+        with iris_api.connection_pool.connection() as sql_connection:
+            sql_operations.save_sync_sources(
+                sources={url: (downloads[url].etag, downloads[url].last_modified) for url in finished_urls},
+                connection=sql_connection,
+                expected_version=sync_sources_version)
+    for url in iris_data_urls:
+        stats[url].total_seconds = time.perf_counter() - started
+        if url not in errors:
+            log.SyncReport(exception=Warning(), url=url, stats=stats[url]).record("INFO")
+    return errors
+
+
+@routes.route("/api/v1/iris/sync", methods=["GET"])
 def sync_iris():
     """
-    Sync iris data from url specified in "url" parameter of the GET request.
-    If no "url" parameter is included, url from env variable DEFAULT_IRIS_DATA_URL is used.
-    Inserts only non-existing (unique) data.
-    :return: String with information about the number of inserted rows.
+    Sync iris data from urls specified in "url" parameters of the GET request.
+    If no "url" parameter is included, urls from env variable IRIS_DATA_URLS
+    (or the single url in DEFAULT_IRIS_DATA_URL) are used.
+    Inserts only non-existing (unique) data. See sync_urls
+    If "background" parameter is 1, sync is run as a background job. Syncs of the same urls share a job.
+    :return: For a single url, string with information about the number of inserted rows.
+    Timings of download, parse and insert are in the Server-Timing header.
+    For several urls, json with the total number of inserted rows and progress counters, timings and error per url.
+    In background mode, job status (see get_sync_job) with code 202.
     """
-    # Parse url if given
-    iris_data_url = flask.request.args.get("url", os.getenv("DEFAULT_IRIS_DATA_URL"))
+    iris_api = get_iris_api()
+    # Parse urls if given
+    iris_data_urls = list(dict.fromkeys(flask.request.args.getlist("url") or iris_api.settings.iris_data_urls))
+    if not iris_data_urls:
+        log_entry = log.UrlError(ValueError("No url given."), url=str())
+        log_entry.record("ERROR")
+        return flask.make_response(log_entry.short, 400)
     try:
-        iris_data_csv = download_url_data(iris_data_url)
-        iris_data = iris.from_csv(iris_data_csv)
-        # Insert to sql
-        result_string = post_iris(iris_data, unique=True)
-        return result_string
-    except (MissingSchema, ConnectionError) as url_error:
-        log_entry = log.UrlError(url_error, iris_data_url)
+        background = parse_bool(flask.request.args.get("background", "0"))
+    except ValueError as bad_parameter_error:
+        log_entry = log.ParameterError(bad_parameter_error)
         log_entry.record("ERROR")
         return flask.make_response(log_entry.short, 400)
-    except HTTPError as download_error:
-        log_entry = log.DownloadError(download_error)
+    stats = {url: sync.SyncStats() for url in iris_data_urls}
+
+    if background:
+        job = iris_api.job_manager.submit(
+            key=f"sync {' '.join(sorted(iris_data_urls))}",
+            function=functools.partial(sync_urls, iris_api, iris_data_urls, stats),
+            progress=stats)
+        response = flask.make_response(flask.jsonify(job.as_dict()), 202)
+        response.headers["Location"] = flask.url_for("iris_api.get_sync_job", job_id=job.id)
+        return response
+
+    try:
+        errors = sync_urls(iris_api, iris_data_urls, stats)
+    except sqlite3.Error as database_error:
+        log_entry = log.SqlConnectError(database_error, database_path=iris_api.settings.sql_path)
         log_entry.record("ERROR")
         return flask.make_response(log_entry.short, 500)
 
+    if len(iris_data_urls) > 1:
+        n_rows_inserted = sum(url_stats.n_rows_inserted for url_stats in stats.values())
+        return flask.jsonify({"n_rows_inserted": n_rows_inserted, "sources": stats})
+    iris_data_url = iris_data_urls[0]
+    if errors:                                                      # Error is already logged by sync_urls
+        log_entry, status_code = get_sync_error(errors[iris_data_url], iris_data_url)
+        return flask.make_response(log_entry.short, status_code)
+    url_stats = stats[iris_data_url]
+    response = flask.make_response(f"Inserted {url_stats.n_rows_inserted} rows.")
+    response.headers["Server-Timing"] = url_stats.server_timing()
+    response.headers["X-Rows-Parsed"] = url_stats.n_rows_parsed
+    return response
+
+
+@routes.route("/api/v1/jobs/<job_id>", methods=["GET"])
+def get_job(job_id: str):
+    """
+    Get status of a background job, e.g. a sync or a chunked delete.
+    :return: Json with job id, state (queued/running/done/failed), progress counters, error and duration in seconds
+    """
+    job = get_iris_api().job_manager.get(job_id)
+    if job is None:
+        return flask.make_response(f"Job {job_id} not found.", 404)
+    return flask.jsonify(job.as_dict())
 
-@app.route("/api/v1/iris/summary", methods=["GET"])
+
+@routes.route("/api/v1/iris/sync/jobs/<job_id>", methods=["GET"])
+def get_sync_job(job_id: str):
+    """Get status of a background sync job. Same as get_job"""
+    return get_job(job_id)
+
+
+@routes.route("/api/v1/iris/summary", methods=["GET"])
 def summarize_iris():
     """Get a json summary of the columns and values in stored data."""
-    iris_sql_path = os.getenv("SQL_PATH", "./iris.sql")
+    iris_api = get_iris_api()
     try:
-        sql_connection = sql_operations.get_connection(iris_sql_path)
+        with iris_api.connection_pool.connection() as sql_connection:
+            sql_iris_table = iris_api.get_iris_table(sql_connection)
+            summary = sql_iris_table.summary()
     except sqlite3.Error as database_error:
-        log_entry = log.SqlConnectError(database_error, database_path=iris_sql_path)
+        log_entry = log.SqlConnectError(database_error, database_path=iris_api.settings.sql_path)
         log_entry.record("ERROR")
         return flask.make_response(log_entry.short, 500)
-    sql_iris_table = sql_operations.SqlIrisInterface(connection=sql_connection)
-    json_summary = flask.jsonify(sql_iris_table.summary())
+    json_summary = flask.jsonify(summary)
     return json_summary
 
 
+@routes.route("/api/v1/stats", methods=["GET"])
+def get_stats():
+    """
+    Get json with internal counters of the API process, e.g. number of dropped log records,
+    result cache hit ratio, write queue counters and the time spent creating the app.
+    """
+    iris_api = get_iris_api()
+    stats = {
+        "logging": log.get_log_stats(iris_api.logger),
+        "result_cache": iris_api.result_cache.stats(),
+        "write_queue": iris_api.write_queue.stats(),
+        "startup": {"startup_seconds": iris_api.startup_seconds}}
+    return flask.jsonify(stats)
+
+
+###############
+# App factory #
+###############
+
+def create_app(settings: Settings = None) -> flask.Flask:
+    """
+    Create the Flask app with its own database connection pool, caches and background jobs (see IrisApi).
+    Settings are resolved once here. Heavy work is deferred until it's needed: the database schema is created
+    with the first connection and requests is imported with the first sync. Time spent is logged and in /stats.
+    :param settings: Settings object. Read from env variables if None, see Settings.from_env
+    :return: flask.Flask object
+    """
+    started = time.perf_counter()
+    settings = Settings.from_env() if settings is None else settings
+    iris_api = IrisApi(settings)
+
+    app = flask.Flask(__name__)
+    app.config["DEBUG"] = settings.debug
+    # Add handlers to Flask loggers
+    # Flask uses a logger by the app name and an inherited 'werkzeug' logger
+    queue_handler = next(
+        handler for handler in iris_api.logger.handlers if isinstance(handler, log.DroppingQueueHandler))
+    flask_loggers = [app.name, "werkzeug"]
+    for flask_logger_name in flask_loggers:
+        flask_logger = logging.getLogger(flask_logger_name)
+        flask_logger.handlers.clear()
+        flask_logger.addHandler(queue_handler)
+        flask_logger.setLevel(settings.log_level)
+
+    app.extensions["iris_api"] = iris_api
+    app.register_blueprint(routes)
+    iris_api.startup_seconds = time.perf_counter() - started
+    log.StartupReport(
+        exception=Warning(),
+        database_path=settings.sql_path,
+        startup_seconds=iris_api.startup_seconds).record("INFO")
+    return app
+
+
 #######
 # Run #
 #######
 
+# Development server. For production, use gunicorn: gunicorn --config gunicorn.conf.py "app:create_app()"
 if __name__ == '__main__':
-    api_host = os.getenv("API_HOST", "0.0.0.0")
-    api_port = os.getenv("API_PORT", 7000)
-
-    app.run(
-        host=api_host,
-        port=api_port,
-        use_reloader=False        # Necessary to function properly on Ubuntu
-    )
+    api_settings = Settings.from_env()
+    api_app = create_app(api_settings)
+    try:
+        api_app.run(
+            host=api_settings.api_host,
+            port=api_settings.api_port,
+            use_reloader=False        # Necessary to function properly on Ubuntu
+        )
+    finally:
+        api_app.extensions["iris_api"].close()
@@ -0,0 +1,42 @@
+# Gunicorn settings for running the API in production:
+#     gunicorn --config gunicorn.conf.py "app:create_app()"
+# API settings are read from env variables in the same way as in app.py (see settings.Settings.from_env).
+
+# local
+from settings import Settings
+import sql_operations
+
+api_settings = Settings.from_env()
+bind = f"{api_settings.api_host}:{api_settings.api_port}"
+# Each worker is a separate process with its own connection pool, caches and background jobs
+workers = api_settings.api_workers
+# Requests are handled by a thread pool in each worker. SQLite releases the GIL while it works
+worker_class = "gthread"
+threads = api_settings.api_threads
+# Seconds a request can take before the worker is restarted. Long syncs should use background=1
+timeout = api_settings.api_timeout
+graceful_timeout = 30
+# App is imported in each worker after forking, so that logging and job threads are started there.
+# Database schema is created once by the master process instead (see on_starting)
+preload_app = False
+accesslog = "-"
+
+
+def on_starting(server) -> None:
+    """
+    Create database schema and apply persistent pragmas (WAL journal) before the workers start,
+    so that workers don't compete for the schema lock on their first requests.
+    """
+    sql_connection = sql_operations.get_connection(api_settings.sql_path)
+    try:
+        sql_operations.apply_pragmas(sql_connection, api_settings.sql_pragmas)
+        sql_operations.SqlIrisInterface.bootstrap(
+            sql_connection, indexed_columns=list(api_settings.sql_indexed_columns))
+    finally:
+        sql_connection.close()
+    server.log.info(f"Database schema ready: {api_settings.sql_path}")
+
+
+def worker_exit(server, worker) -> None:
+    """Wait for background jobs and queued writes of the worker's app, then close its connections. See IrisApi.close"""
+    worker.wsgi.extensions["iris_api"].close()
@@ -1,10 +1,31 @@
 
 # standard
+from array import array
+from collections import Counter
 import csv
+import io
+import itertools
 import json
+import math
+import operator
+import re
+import struct
+import sys
+from typing import Callable, Iterable, Iterator
 # local
 import log
 
+JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Name for csv values past the last header column, in forbidden attribute warnings
+UNNAMED_CSV_COLUMN = "<unnamed column>"
+# Number of distinct key sets to remember when checking json rows for forbidden keys
+MAX_DISTINCT_KEY_SETS = 64
+
+# Binary columnar export format. See BinaryColumnsEncoder
+BINARY_MAGIC = b"IRIS"
+BINARY_FORMAT_VERSION = 1
+BINARY_FLOAT64 = 1                  # Column type: packed float64 values
+BINARY_DICTIONARY = 2               # Column type: uint32 codes into a dictionary of distinct strings
 
 ###########
 # Classes #
@@ -21,75 +42,554 @@ class Iris:
     petal_width: float
     species: str
 
+    # Values are stored in slots instead of a per-instance __dict__. Has to match annotations.
+    __slots__ = ("sepal_length", "sepal_width", "petal_length", "petal_width", "species")
+
     def __init__(self, **kwargs):
         """Extract class attributes from input. If attribute is not found, assign empty value with correct type."""
-        allowed_attributes = self.__class__.__annotations__
-        for attribute, attribute_type in allowed_attributes.items():
-            self.__setattr__(attribute, kwargs.pop(attribute, attribute_type()))
+        for attribute, attribute_type, set_slot in self._fields:
+            value = kwargs.pop(attribute, None)
+            # Typecast the assigned value according to the type of the class attribute (float, int etc.)
+            set_slot(self, attribute_type(value) if value else attribute_type())
         if len(kwargs):
             log_entry = log.ForbiddenAttributes(
                 exception=Warning(),
                 class_name=self.__class__.__name__,
                 received_attributes=list(kwargs.keys()),
-                allowed_attributes=allowed_attributes)
+                allowed_attributes=self.__class__.__annotations__)
             log_entry.record("WARNING")
 
     def __setattr__(self, key, value):
         """Only allow attributes defined in class variables."""
         allowed_attributes = self.__class__.__annotations__
-        problem_keys = list()
         if key in allowed_attributes:
             # Typecast the assigned value according to the type of the class attribute (float, int etc.)
             typed_value = allowed_attributes[key](value) if value else allowed_attributes[key]()
-            super().__setattr__(key, typed_value)
+            object.__setattr__(self, key, typed_value)
         else:
-            problem_keys += [key]
-        if len(problem_keys):
             log_entry = log.ForbiddenAttributes(
                 exception=Warning(),
                 class_name=self.__class__.__name__,
-                received_attributes=problem_keys,
+                received_attributes=[key],
                 allowed_attributes=allowed_attributes)
             log_entry.record("WARNING")
 
     def __hash__(self):
         """Hash function to compare and get unique instances of Iris by using a set"""
-        return hash(json.dumps(self.as_dict(), sort_keys=True))
+        return hash(self.as_tuple())
 
     def __eq__(self, other):
-        return hash(self) == hash(other)
+        if not isinstance(other, Iris):
+            return NotImplemented
+        return self.as_tuple() == other.as_tuple()
 
     def __str__(self):
-        values = [f"{attribute}: {self.__getattribute__(attribute)}" for attribute in self.__class__.__annotations__]
+        values = [f"{attribute}: {value}" for attribute, value in self.as_dict().items()]
         return ", ".join(values)
 
+    def as_tuple(self) -> tuple:
+        """Return values of all class attributes (i.e. columns) in the order of class annotations."""
+        return self._get_values(self)
+
     def as_dict(self) -> dict:
         """Return all class attributes (i.e. columns) and their values as a dict."""
-        return {attribute: self.__getattribute__(attribute)
-                for attribute in self.__class__.__annotations__}
+        return dict(zip(self.__slots__, self.as_tuple()))
+
+
+# Precomputed attribute names, types and slot setters, so that object creation doesn't go through annotations
+Iris._fields = tuple((attribute, attribute_type, getattr(Iris, attribute).__set__)
+                     for attribute, attribute_type in Iris.__annotations__.items())
+Iris._get_values = operator.attrgetter(*Iris.__slots__)
+
+
+class IrisBatch:
+    """
+    Columnar container for many rows of Iris data.
+    Float columns are stored in array("d") and string columns as integer codes in array("I"),
+    with a list of distinct values (categories) per column. Uses a fraction of the memory of a list of Iris objects
+    and lets callers work on whole columns. Arrays support the buffer protocol, e.g. numpy.frombuffer can use them.
+    Behaves like a read-only sequence of Iris objects (len, indexing, iteration) for compatibility.
+    """
+    column_names = Iris.__slots__
+
+    def __init__(self) -> None:
+        self._columns = dict()              # {column name: array} with values or category codes
+        self._categories = dict()           # {column name: [category values]} for string columns
+        self._category_codes = dict()       # {column name: {category value: code}} for string columns
+        for attribute, attribute_type, _ in Iris._fields:
+            if attribute_type is str:
+                self._columns[attribute] = array("I")
+                self._categories[attribute] = list()
+                self._category_codes[attribute] = dict()
+            else:
+                self._columns[attribute] = array("d")
+
+    def __len__(self) -> int:
+        return len(self._columns[self.column_names[0]])
+
+    def __getitem__(self, index: (int | slice)) -> "Iris | IrisBatch":
+        if isinstance(index, slice):            # Slices the column arrays, so any step (also negative) works
+            batch = IrisBatch()
+            for column_name in self.column_names:
+                batch._columns[column_name] = self._columns[column_name][index]
+            for column_name in self._categories:    # Category codes stay valid, unused categories are kept
+                batch._categories[column_name] = list(self._categories[column_name])
+                batch._category_codes[column_name] = dict(self._category_codes[column_name])
+            return batch
+        values = dict()
+        for column_name in self.column_names:
+            value = self._columns[column_name][index]
+            values[column_name] = self._categories[column_name][value] if column_name in self._categories else value
+        return Iris(**values)
+
+    def __iter__(self) -> Iterator[Iris]:
+        for values in self.rows():
+            yield Iris(**dict(zip(self.column_names, values)))
+
+    def append_values(self, values: tuple) -> None:
+        """Add a row of already typecast values, in the order of column_names."""
+        for column_name, value in zip(self.column_names, values):
+            if column_name in self._categories:
+                codes = self._category_codes[column_name]
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(codes)
+                    self._categories[column_name] += [value]
+                value = code
+            self._columns[column_name].append(value)
+
+    def append(self, **kwargs) -> None:
+        """Add a row from unprocessed values. Values are typecast and checked like in Iris.__init__."""
+        values = list()
+        for attribute, attribute_type, _ in Iris._fields:
+            value = kwargs.pop(attribute, None)
+            values += [attribute_type(value) if value else attribute_type()]
+        self.append_values(tuple(values))
+        if len(kwargs):
+            log_entry = log.ForbiddenAttributes(
+                exception=Warning(),
+                class_name=Iris.__name__,
+                received_attributes=list(kwargs.keys()),
+                allowed_attributes=Iris.__annotations__)
+            log_entry.record("WARNING")
+
+    def column(self, column_name: str) -> (array | list):
+        """Get values of a single column. Array for numeric columns, list of values for categorical columns."""
+        if column_name in self._categories:
+            categories = self._categories[column_name]
+            return [categories[code] for code in self._columns[column_name]]
+        return self._columns[column_name]
+
+    def rows(self) -> Iterator[tuple]:
+        """Iterate over rows as value tuples in the order of column_names. E.g. for inserting to SQLite."""
+        return zip(*[self.column(column_name) for column_name in self.column_names])
+
+    def to_dicts(self) -> list[dict]:
+        """Get rows as a list of dicts, i.e. in json format."""
+        return [dict(zip(self.column_names, values)) for values in self.rows()]
+
+    def to_csv(self) -> str:
+        """Get data in csv format, with a header row."""
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator="\n")
+        writer.writerow(self.column_names)
+        writer.writerows(self.rows())
+        return output.getvalue()
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple]) -> "IrisBatch":
+        """Create batch from already typecast value tuples, e.g. rows from SQLite."""
+        batch = cls()
+        for values in rows:
+            batch.append_values(values)
+        return batch
+
+    @classmethod
+    def from_dicts(cls, rows: Iterable[dict], forbidden_counts: Counter = None) -> "IrisBatch":
+        """
+        Create batch from dicts of unprocessed values, e.g. rows from json.
+        Values are typecast like in Iris.__init__. Keys are checked once per distinct set of keys.
+        Raises ValueError for values that are json objects or arrays (see typecast_json_value).
+        :param rows: Iterable of dicts
+        :param forbidden_counts: Counter to add the number of rows with each forbidden key to.
+        If not given, forbidden keys are logged in one warning when the batch is ready.
+        :return: IrisBatch
+        """
+        batch = cls()
+        report = forbidden_counts is None
+        forbidden_counts = Counter() if report else forbidden_counts
+        fields = [(attribute, attribute_type) for attribute, attribute_type, _ in Iris._fields]
+        forbidden_keys = dict()         # {keys of a row: forbidden keys}. Rows usually have the same keys
+        for row in rows:
+            if not isinstance(row, dict):
+                raise ValueError(f"Expected an object for each row, got {row.__class__.__name__}.")
+            keys = tuple(row)
+            forbidden = forbidden_keys.get(keys)
+            if forbidden is None:
+                if len(forbidden_keys) >= MAX_DISTINCT_KEY_SETS:
+                    forbidden_keys.clear()
+                forbidden = forbidden_keys[keys] = [key for key in keys if key not in Iris.__annotations__]
+            if forbidden:
+                forbidden_counts.update(forbidden)
+            batch.append_values(tuple(
+                typecast_json_value(row.get(attribute), attribute, attribute_type)
+                for attribute, attribute_type in fields))
+        if report:
+            report_forbidden_attributes(forbidden_counts)
+        return batch
+
+    @classmethod
+    def from_csv_rows(cls, rows: Iterable[list], fields: list[tuple], n_columns: int,
+                      forbidden_counts: Counter) -> "IrisBatch":
+        """
+        Create batch from csv rows of unprocessed values. Values are typecast like in Iris.__init__.
+        :param rows: Iterable of csv rows (lists of strings), without the header
+        :param fields: Positions of Iris columns in rows and their types. See parse_csv_header
+        :param n_columns: Number of columns in the header. Values past the header are counted as forbidden
+        :param forbidden_counts: Counter to add the number of rows with values past the header to
+        :return: IrisBatch
+        """
+        batch = cls()
+        for row in rows:
+            n_values = len(row)
+            if n_values > n_columns:
+                forbidden_counts[UNNAMED_CSV_COLUMN] += 1
+            batch.append_values(tuple(
+                attribute_type(row[index]) if index is not None and index < n_values and row[index]
+                else attribute_type()
+                for index, attribute_type in fields))
+        return batch
+
+
+class BinaryColumnsEncoder:
+    """
+    Encodes rows of Iris values to a compact columnar binary format, batch by batch, so that it can be streamed.
+    Float columns are packed float64 values. String columns (species) are uint32 codes into a dictionary of
+    distinct values. The dictionary grows as new values appear and each batch only carries the new values.
+    Values are typecast like in Iris.
+
+    Layout (all numbers little-endian):
+        header: b"IRIS", uint8 format version (1), uint8 number of columns,
+                for each column: uint8 type (1: float64, 2: dictionary), uint8 name length, name (utf-8)
+        batch:  uint32 number of rows (n), then for each column in header order:
+                float64 column: n float64 values
+                dictionary column: uint32 number of new dictionary values,
+                                   for each new value: uint32 length, value (utf-8),
+                                   then n uint32 codes (positions in the dictionary of all batches so far)
+        end:    uint32 0 (a batch without rows)
+    See iter_binary_batches for reading. Float columns can also be read with numpy.frombuffer(dtype="<f8").
+
+    Instance attributes:
+    columns: Column names, in the order of values in rows
+    """
+
+    def __init__(self, columns: list[str]) -> None:
+        self.columns = list(columns)
+        self._column_types = [Iris.__annotations__[column] for column in self.columns]
+        self._category_codes = {column: dict() for column, column_type in zip(self.columns, self._column_types)
+                                if column_type is str}
+
+    def header(self) -> bytes:
+        """Format identifier and column names and types."""
+        header = [BINARY_MAGIC, struct.pack("<BB", BINARY_FORMAT_VERSION, len(self.columns))]
+        for column, column_type in zip(self.columns, self._column_types):
+            name = column.encode()
+            header += [struct.pack("<BB", BINARY_DICTIONARY if column_type is str else BINARY_FLOAT64, len(name)), name]
+        return b"".join(header)
+
+    def encode_batch(self, rows: list[tuple]) -> bytes:
+        """
+        Encode a batch of rows.
+        :param rows: Value tuples in the order of columns, e.g. from an SQLite cursor. Shouldn't be empty
+        :return: Encoded batch
+        """
+        encoded = [struct.pack("<I", len(rows))]
+        for column, column_type, values in zip(self.columns, self._column_types, zip(*rows)):
+            if column_type is str:
+                codes = self._category_codes[column]
+                n_categories = len(codes)
+                column_codes = array("I", [
+                    codes.setdefault(str(value) if value else str(), len(codes)) for value in values])
+                new_categories = [category.encode() for category in itertools.islice(codes, n_categories, None)]
+                encoded += [struct.pack("<I", len(new_categories))]
+                encoded += [struct.pack("<I", len(category)) + category for category in new_categories]
+                column_array = column_codes
+            else:
+                column_array = array("d", [float(value) if value else float() for value in values])
+            if sys.byteorder == "big":
+                column_array.byteswap()
+            encoded += [column_array.tobytes()]
+        return b"".join(encoded)
+
+    @staticmethod
+    def end() -> bytes:
+        """End marker: a batch without rows."""
+        return struct.pack("<I", 0)
 
 
 #############
 # Functions #
 #############
 
-def from_csv(data: str) -> list[Iris]:
+def split_lines(chunks: Iterable[str]) -> Iterator[str]:
+    """
+    Split text chunks (e.g. decoded from a network stream) to lines, with line endings kept (as expected by csv.reader).
+    :param chunks: Iterable of text chunks. Lines can be split between chunks
+    :return: Iterator of lines
+    """
+    remainder = str()
+    for chunk in chunks:
+        lines = (remainder + chunk).splitlines(keepends=True)
+        # Last line may continue in the next chunk. "\r" may be the first half of "\r\n"
+        remainder = lines.pop() if lines and not lines[-1].endswith("\n") else str()
+        yield from lines
+    if remainder:
+        yield remainder
+
+
+def typecast_json_value(value: object, attribute: str, attribute_type: type) -> (float | str):
+    """
+    Typecast a json value like in Iris.__init__.
+    Raises ValueError for json objects and arrays, that would otherwise fail with TypeError (float)
+    or be stored as their Python representation (str).
+    """
+    if isinstance(value, (dict, list)):
+        raise ValueError(f"Expected a number or a string for {attribute}, got {value.__class__.__name__}: {value}")
+    return attribute_type(value) if value else attribute_type()
+
+
+def report_forbidden_attributes(forbidden_counts: Counter) -> None:
+    """Log a single warning for all forbidden attributes found while parsing many rows, if there were any."""
+    if not forbidden_counts:
+        return
+    log_entry = log.ForbiddenAttributes(
+        exception=Warning(),
+        class_name=Iris.__name__,
+        received_attributes=list(forbidden_counts),
+        allowed_attributes=Iris.__annotations__,
+        n_rows=dict(forbidden_counts))
+    log_entry.record("WARNING")
+
+
+def parse_csv_header(header: list[str]) -> tuple[list[tuple], list[str]]:
+    """
+    Find the positions of Iris columns in a csv header.
+    :param header: Column names
+    :return: A tuple ([(position or None if missing, type) for each Iris attribute], [forbidden column names])
+    """
+    positions = {column_name: index for index, column_name in enumerate(header)}       # Last one wins on duplicates
+    fields = [(positions.get(attribute), attribute_type) for attribute, attribute_type, _ in Iris._fields]
+    forbidden_columns = [column_name for column_name in positions if column_name not in Iris.__annotations__]
+    return fields, forbidden_columns
+
+
+def from_csv(data: str) -> IrisBatch:
     """
-    Parse Iris objects from csv data
+    Parse Iris data from csv data
     :param data: Iris data in csv format
-    :return: List of Iris objects, representing the rows of the data.
+    :return: IrisBatch with the rows of the data.
+    """
+    lines = data.splitlines()
+    iris_batches = list(iter_csv_batches(lines, batch_size=len(lines) + 1))         # All rows in a single batch
+    return iris_batches[0] if iris_batches else IrisBatch()
+
+
+def iter_csv_batches(lines: Iterable[str], batch_size: int) -> Iterator[IrisBatch]:
+    """
+    Parse Iris data from csv lines incrementally, e.g. from a file or network stream.
+    Only one batch of rows is kept in memory at a time.
+    Header is checked once. Forbidden columns are logged in one warning when parsing ends.
+    :param lines: Iterable of csv lines, starting with the header
+    :param batch_size: Number of rows per batch
+    :return: Iterator of IrisBatch objects with at most batch_size rows each
+    """
+    rows = (row for row in csv.reader(lines) if row)                    # Skip empty lines
+    header = next(rows, None)
+    if header is None:
+        return
+    fields, forbidden_columns = parse_csv_header(header)
+    forbidden_counts = Counter()
+    try:
+        while batch := IrisBatch.from_csv_rows(itertools.islice(rows, batch_size), fields, len(header),
+                                               forbidden_counts):
+            for column_name in forbidden_columns:
+                forbidden_counts[column_name] += len(batch)
+            yield batch
+    finally:
+        report_forbidden_attributes(forbidden_counts)
+
+
+def iter_json_records(chunks: Iterable[str]) -> Iterator[dict]:
+    """
+    Decode records from a json array (or a single json object) incrementally, one record at a time.
+    Only the undecoded part of the input is kept in memory.
+    :param chunks: Iterable of json text chunks, e.g. from a file or network stream
+    :return: Iterator of decoded records
+    """
+    decoder = json.JSONDecoder()
+    buffer = str()
+    position = 0
+    state = "start"                 # start -> (value -> separator)* -> end
+    for chunk in itertools.chain(chunks, [None]):                 # None marks the end of input
+        end_of_input = chunk is None
+        buffer = buffer[position:] + (chunk or str())
+        position = 0
+        while True:
+            position = JSON_WHITESPACE.match(buffer, position).end()
+            if position == len(buffer):
+                break                                               # Need more input
+            character = buffer[position]
+            if state == "start" and character == "[":
+                state = "first_value"
+                position += 1
+            elif character == "]" and state in ("first_value", "separator"):
+                state = "end"
+                position += 1
+            elif state == "separator" and character == ",":
+                state = "value"
+                position += 1
+            elif state in ("start", "first_value", "value"):
+                try:
+                    record, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if end_of_input:
+                        raise
+                    break                                           # Record is incomplete - need more input
+                yield record
+                state = "end" if state == "start" else "separator"      # Input without array is a single record
+            else:
+                raise ValueError(f"Unexpected character in json input: '{character}'.")
+    if state != "end":
+        raise ValueError("Json input ended unexpectedly.")
+
+
+def iter_json_batches(chunks: Iterable[str], batch_size: int) -> Iterator[IrisBatch]:
+    """
+    Parse Iris data incrementally from a json array (or a single json object)
+    :param chunks: Iterable of json text chunks, e.g. from a file or network stream
+    :param batch_size: Number of rows per batch
+    :return: Iterator of IrisBatch objects with at most batch_size rows each
+    """
+    records = iter_json_records(chunks)
+    forbidden_counts = Counter()
+    try:
+        while batch := IrisBatch.from_dicts(itertools.islice(records, batch_size), forbidden_counts):
+            yield batch
+    finally:
+        report_forbidden_attributes(forbidden_counts)
+
+
+def iter_ndjson_batches(lines: Iterable[str], batch_size: int) -> Iterator[IrisBatch]:
     """
-    data_raw = csv.DictReader(data.splitlines())
-    iris_data = list()
-    for row in data_raw:
-        iris_data += [Iris(**row)]
-    return iris_data
+    Parse Iris data incrementally from newline delimited json, i.e. one json object per line. Empty lines are skipped.
+    :param lines: Iterable of lines, e.g. from a file or network stream
+    :param batch_size: Number of rows per batch
+    :return: Iterator of IrisBatch objects with at most batch_size rows each
+    """
+    records = (json.loads(line) for line in lines if line.strip())
+    forbidden_counts = Counter()
+    try:
+        while batch := IrisBatch.from_dicts(itertools.islice(records, batch_size), forbidden_counts):
+            yield batch
+    finally:
+        report_forbidden_attributes(forbidden_counts)
 
 
-def from_json(data: list) -> list[Iris]:
+def from_json(data: list) -> IrisBatch:
     """
-    Parse Iris objects from json data
+    Parse Iris data from json data
     :param data: Iris data in json (i.e. dict) format
-    :return: List of Iris objects, representing the rows of the data.
+    :return: IrisBatch with the rows of the data.
+    """
+    return IrisBatch.from_dicts(data)
+
+
+def encode_json_float(value: object) -> str:
+    """Typecast a value to float like Iris does and encode it as json."""
+    value = float(value) if value else float()
+    return float.__repr__(value) if math.isfinite(value) else json.dumps(value)
+
+
+def encode_json_str(value: object) -> str:
+    """Typecast a value to str like Iris does and encode it as json (ascii only, same as json.dumps)."""
+    return json.encoder.encode_basestring_ascii(str(value) if value else str())
+
+
+def get_json_row_encoder(columns: list[str]) -> Callable[[tuple], str]:
+    """
+    Get a function that serializes a row of Iris values (e.g. from an SQLite cursor) directly to a json object,
+    without creating Iris objects or dicts. Key order and value encoders are precomputed for the columns.
+    Output is the same as json.dumps(Iris(**row).as_dict(), sort_keys=True, separators=(",", ":")),
+    limited to the given columns.
+    :param columns: Column names, in the order of the values in rows
+    :return: Function that takes a row tuple and returns a json string
+    """
+    value_encoders = {float: encode_json_float, str: encode_json_str}
+    sorted_columns = sorted(enumerate(columns), key=operator.itemgetter(1))       # Keys are sorted, like in jsonify
+    template = "{" + ",".join(f"{json.dumps(column).replace('%', '%%')}:%s" for _, column in sorted_columns) + "}"
+    encoders = tuple(
+        (index, value_encoders.get(Iris.__annotations__.get(column), json.dumps)) for index, column in sorted_columns)
+
+    def encode_row(row: tuple) -> str:
+        return template % tuple([encode(row[index]) for index, encode in encoders])
+
+    return encode_row
+
+
+def get_row_typecaster(columns: list[str]) -> Callable[[tuple], tuple]:
+    """
+    Get a function that typecasts a row of values like Iris does (e.g. NULL becomes 0.0 or ""),
+    without creating Iris objects.
+    :param columns: Iris column names, in the order of the values in rows
+    :return: Function that takes a row tuple and returns a tuple of typecast values
+    """
+    column_types = [Iris.__annotations__[column] for column in columns]
+
+    def typecast_row(row: tuple) -> tuple:
+        return tuple([column_type(value) if value else column_type() for column_type, value in zip(column_types, row)])
+
+    return typecast_row
+
+
+def read_exactly(read: Callable[[int], bytes], n_bytes: int) -> bytes:
+    """Read a number of bytes. Raises ValueError if the data ends before that."""
+    data = read(n_bytes)
+    if len(data) != n_bytes:
+        raise ValueError(f"Unexpected end of data. Expected {n_bytes} bytes, got {len(data)}.")
+    return data
+
+
+def iter_binary_batches(read: Callable[[int], bytes]) -> Iterator[dict]:
+    """
+    Read data in the binary columnar format (see BinaryColumnsEncoder) batch by batch.
+    :param read: Function that reads a number of bytes, e.g. io.BytesIO(data).read or a file object's read
+    :return: Iterator of {column name: values} dicts, one per batch. Float columns are array("d"), string columns lists
     """
-    return [Iris(**row) for row in data]
+    if read_exactly(read, len(BINARY_MAGIC)) != BINARY_MAGIC:
+        raise ValueError("Data is not in the Iris binary format.")
+    version, n_columns = struct.unpack("<BB", read_exactly(read, 2))
+    if version != BINARY_FORMAT_VERSION:
+        raise ValueError(f"Unsupported Iris binary format version: {version}.")
+    columns = list()                            # [(column name, column type)]
+    for _ in range(n_columns):
+        column_type, name_length = struct.unpack("<BB", read_exactly(read, 2))
+        columns += [(read_exactly(read, name_length).decode(), column_type)]
+    categories = {name: list() for name, column_type in columns if column_type == BINARY_DICTIONARY}
+    while n_rows := struct.unpack("<I", read_exactly(read, 4))[0]:
+        batch = dict()
+        for name, column_type in columns:
+            if column_type == BINARY_DICTIONARY:
+                for _ in range(struct.unpack("<I", read_exactly(read, 4))[0]):
+                    length = struct.unpack("<I", read_exactly(read, 4))[0]
+                    categories[name] += [read_exactly(read, length).decode()]
+                column_array = array("I")
+            else:
+                column_array = array("d")
+            column_array.frombytes(read_exactly(read, n_rows * column_array.itemsize))
+            if sys.byteorder == "big":
+                column_array.byteswap()
+            if column_type == BINARY_DICTIONARY:
+                batch[name] = [categories[name][code] for code in column_array]
+            else:
+                batch[name] = column_array
+        yield batch
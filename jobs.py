@@ -0,0 +1,132 @@
+# standard
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict, is_dataclass
+import threading
+import time
+from typing import Callable
+import uuid
+# local
+import log
+
+# Finished jobs are kept for status requests until this many newer jobs have finished
+DEFAULT_MAX_FINISHED_JOBS = 1000
+
+
+###########
+# Classes #
+###########
+
+@dataclass
+class Job:
+    """
+    Background job. State goes from "queued" to "running" and then to "done" or "failed".
+    Progress is an object that the job function updates while it runs, e.g. sync.SyncStats or a dict of them.
+    """
+    key: str                                    # Jobs with the same key are coalesced while the first one is active
+    progress: object = None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    state: str = "queued"
+    error: (str | None) = None
+    created: float = field(default_factory=time.time)
+    started: (float | None) = None
+    finished: (float | None) = None
+    _finished_event: threading.Event = field(default_factory=threading.Event, repr=False, compare=False)
+
+    @property
+    def active(self) -> bool:
+        return self.state in ("queued", "running")
+
+    @property
+    def duration(self) -> (float | None):
+        """Seconds the job has been running, or ran for. None if the job hasn't started."""
+        if self.started is None:
+            return None
+        return (self.finished or time.time()) - self.started
+
+    def wait(self, timeout: float = None) -> bool:
+        """Wait for the job to finish. Returns False if timeout is reached first."""
+        return self._finished_event.wait(timeout)
+
+    def as_dict(self) -> dict:
+        """Job status for json responses."""
+        progress = self.progress
+        if isinstance(progress, dict):              # E.g. progress per url
+            progress = {key: asdict(value) if is_dataclass(value) else value for key, value in progress.items()}
+        elif is_dataclass(progress):
+            progress = asdict(progress)
+        return {
+            "id": self.id,
+            "key": self.key,
+            "state": self.state,
+            "progress": progress,
+            "error": self.error,
+            "duration_seconds": self.duration}
+
+
+class JobManager:
+    """
+    Runs jobs on a thread pool and keeps their status.
+    Submitting a job with the same key as an active job returns the active job instead of starting a new one.
+    Job status is kept in the memory of the process.
+
+    Instance attributes:
+    max_workers: Number of jobs that can run at the same time. Other jobs wait in a queue
+    max_finished_jobs: Number of finished jobs to keep status of
+    """
+
+    def __init__(self, max_workers: int = 2, max_finished_jobs: int = DEFAULT_MAX_FINISHED_JOBS) -> None:
+        self.max_workers = max_workers
+        self.max_finished_jobs = max_finished_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._jobs = dict()                     # {job id: Job}. Insertion order is used for dropping old jobs
+        self._active_jobs = dict()              # {job key: Job}
+
+    def submit(self, key: str, function: Callable[[], object], progress: object = None) -> Job:
+        """
+        Start a job, unless a job with the same key is already active.
+        :param key: Job key, e.g. "sync <url>"
+        :param function: Function to run. Exceptions mark the job as failed
+        :param progress: Object that the function updates while it runs
+        :return: New Job or the active Job with the same key
+        """
+        with self._lock:
+            active_job = self._active_jobs.get(key)
+            if active_job is not None:
+                return active_job
+            job = Job(key=key, progress=progress)
+            self._jobs[job.id] = job
+            self._active_jobs[key] = job
+        self._executor.submit(self._run, job, function)
+        return job
+
+    def get(self, job_id: str) -> (Job | None):
+        """Get job by id. None if the job doesn't exist or its status isn't kept anymore."""
+        return self._jobs.get(job_id)
+
+    def _run(self, job: Job, function: Callable[[], object]) -> None:
+        job.started = time.time()
+        job.state = "running"
+        try:
+            function()
+            state = "done"
+        except Exception as exception:
+            job.error = f"{exception.__class__.__name__}: {exception}"
+            state = "failed"
+            log.JobError(exception, job_key=job.key, job_id=job.id).record("ERROR")
+        with self._lock:                        # New jobs with the same key can be started from here on
+            job.finished = time.time()
+            job.state = state
+            del self._active_jobs[job.key]
+            job._finished_event.set()
+            n_finished_jobs = len(self._jobs) - len(self._active_jobs)
+            for job_id in list(self._jobs):
+                if n_finished_jobs <= self.max_finished_jobs:
+                    break
+                if not self._jobs[job_id].active:
+                    del self._jobs[job_id]
+                    n_finished_jobs -= 1
+
+    def shutdown(self) -> None:
+        """Stop accepting jobs and wait for the running jobs to finish."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
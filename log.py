@@ -1,29 +1,84 @@
 
+import atexit
+from collections import Counter
 from dataclasses import dataclass, field
 import logging
+import logging.handlers
 import os
+import queue
 
+# Maximum number of log records waiting to be written to stdout. See DroppingQueueHandler
+DEFAULT_LOG_QUEUE_SIZE = 10000
 
-def setup_logger(name: str, level: str, indicator: str) -> logging.Logger:
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Handler that puts log records to a bounded queue, to be written by a QueueListener in a background thread.
+    If the queue is full (e.g. log output is slow), new records are dropped instead of blocking the logging thread.
+    Dropped records are counted per level.
+    """
+
+    def __init__(self, record_queue: queue.Queue) -> None:
+        logging.handlers.QueueHandler.__init__(self, record_queue)
+        self.dropped_records = Counter()            # {level name: number of dropped records}
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_records[record.levelname] += 1         # Handler lock is held, see logging.Handler.handle
+
+    def stats(self) -> dict:
+        """Queue size and dropped record counts."""
+        return {
+            "queued_records": self.queue.qsize(),
+            "max_queued_records": self.queue.maxsize,
+            "dropped_records": dict(self.dropped_records)}
+
+
+def setup_logger(name: str, level: str, indicator: str, queue_size: int = DEFAULT_LOG_QUEUE_SIZE) -> logging.Logger:
     """
     Create a logger with custom format, that can be parsed by external log receiver
+    Records are written to stdout by a background thread, so that log output never blocks the logging thread.
+    See DroppingQueueHandler
+    If the logger is already set up (e.g. by an earlier app.create_app call), only its level is changed.
     :param name: Name for the log messages emitted by the application
     :param level: Level of log messages that the logger sends (DEBUG/INFO/WARNING/ERROR)
     :param indicator: Unique indicator to let external log receiver distinguish which stdout entries came from the app
+    :param queue_size: Maximum number of records waiting to be written. Records over the limit are dropped
     :return: a logging.Logger object with assigned handler and formatter
     """
     logger = logging.getLogger(name)
     logger.setLevel(level)
-    handler = logging.StreamHandler()              # Direct logs to stdout
+    if any(isinstance(handler, DroppingQueueHandler) for handler in logger.handlers):
+        return logger
+    stream_handler = logging.StreamHandler()              # Direct logs to stdout
     formatter = logging.Formatter(
         fmt=f"{indicator}{{asctime}} | {{name}} | {{funcName}} | {{levelname}}: {{message}}",
         datefmt="%m/%d/%Y %H:%M:%S",
         style="{")
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    stream_handler.setFormatter(formatter)
+    record_queue = queue.Queue(maxsize=queue_size)
+    listener = logging.handlers.QueueListener(record_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)                  # Writes out the queued records
+    logger.addHandler(DroppingQueueHandler(record_queue))
     return logger
 
 
+def get_log_stats(logger: logging.Logger) -> dict:
+    """Queue size and dropped record counts of the queued handlers of a logger. See DroppingQueueHandler"""
+    stats = {"queued_records": 0, "max_queued_records": 0, "dropped_records": Counter()}
+    for handler in logger.handlers:
+        if isinstance(handler, DroppingQueueHandler):
+            handler_stats = handler.stats()
+            stats["queued_records"] += handler_stats["queued_records"]
+            stats["max_queued_records"] += handler_stats["max_queued_records"]
+            stats["dropped_records"].update(handler_stats["dropped_records"])
+    stats["dropped_records"] = dict(stats["dropped_records"])
+    return stats
+
+
 @dataclass
 class LogString:
     """
@@ -89,6 +144,42 @@ class SqlGetError(LogString):
         self.full = f"{self.short} {self.exception}"
 
 
+@dataclass
+class PostDataError(LogString):
+    """Error in parsing posted data. Rows parsed before the error may already be inserted"""
+    n_rows_inserted: int
+
+    def __post_init__(self):
+        self.set_logger()
+        self.exception_type = self.exception.__class__.__name__
+        self.short = f"While parsing posted data, {self.exception_type} occurred. " \
+                     f"Inserted {self.n_rows_inserted} rows before the error."
+        self.full = f"{self.short} Error: {self.exception}."
+
+
+@dataclass
+class ParameterError(LogString):
+    """Bad value of a request parameter"""
+    def __post_init__(self):
+        self.set_logger()
+        self.exception_type = self.exception.__class__.__name__
+        self.short = f"While parsing request parameters, {self.exception_type} occurred."
+        self.full = f"{self.short} {self.exception}"
+
+
+@dataclass
+class JobError(LogString):
+    """Error in a background job"""
+    job_key: str
+    job_id: str
+
+    def __post_init__(self):
+        self.set_logger()
+        self.exception_type = self.exception.__class__.__name__
+        self.short = f"While running background job {self.job_id}, {self.exception_type} occurred."
+        self.full = f"{self.short} Job: {self.job_key}. Error: {self.exception}."
+
+
 @dataclass
 class UrlError(LogString):
     """Bad url"""
@@ -117,10 +208,66 @@ class ForbiddenAttributes(LogString):
     class_name: str
     received_attributes: list
     allowed_attributes: dict
+    n_rows: dict = None                     # {attribute: number of rows}, if the attributes were found in bulk parsing
 
     def __post_init__(self):
         self.set_logger()
         self.short = f"Can't assign forbidden attributes to class {self.class_name}."
-        self.full = f"{self.short} Problematic attributes: {', '.join(self.received_attributes)}. " \
+        received_attributes = self.received_attributes
+        if self.n_rows is not None:
+            received_attributes = [f"{attribute} ({self.n_rows[attribute]} rows)" for attribute in received_attributes]
+        self.full = f"{self.short} Problematic attributes: {', '.join(received_attributes)}. " \
                     f"Only the following attributes are allowed: " \
                     f"{', '.join(list(self.allowed_attributes.keys()))}."
+
+
+@dataclass(kw_only=True)
+class SlowQuery(LogString):
+    """Warning for a filtered query that took longer than expected"""
+    table: str
+    where: str
+    duration: float
+    query_plan: list
+
+    def __post_init__(self):
+        self.set_logger()
+        self.short = f"Slow query on table {self.table}: {self.duration:.3f} seconds."
+        self.full = f"{self.short} Filter:{self.where}. Query plan: {' | '.join(self.query_plan)}."
+
+
+@dataclass(kw_only=True)
+class ColumnUsage(LogString):
+    """Report of how often table columns are used in "where"-statements"""
+    table: str
+    column_usage: list
+
+    def __post_init__(self):
+        self.set_logger()
+        self.short = f"Column usage in where statements on table {self.table}."
+        self.full = f"{self.short} {', '.join([f'{column}: {count}' for column, count in self.column_usage])}."
+
+
+@dataclass(kw_only=True)
+class SyncReport(LogString):
+    """Report of a finished sync: progress counters and time spent in each stage"""
+    url: str
+    stats: object           # sync.SyncStats
+
+    def __post_init__(self):
+        self.set_logger()
+        self.short = f"Synced {self.stats.n_rows_inserted} new rows from {self.url}."
+        self.full = f"{self.short} Parsed rows: {self.stats.n_rows_parsed}. " \
+                    f"Downloaded bytes: {self.stats.n_bytes_downloaded}. " \
+                    f"Timings (ms): {self.stats.server_timing()}."
+
+
+@dataclass(kw_only=True)
+class StartupReport(LogString):
+    """Report of a created app: time spent creating it"""
+    database_path: str
+    startup_seconds: float
+
+    def __post_init__(self):
+        self.set_logger()
+        self.short = f"App created in {self.startup_seconds * 1000:.1f} ms."
+        self.full = f"{self.short} Database path: {self.database_path}."
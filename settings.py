@@ -0,0 +1,125 @@
+# standard
+from dataclasses import dataclass, field, fields
+import os
+from typing import Callable, Mapping
+# local
+import log
+import sql_operations
+import sync
+
+# Importing this module has no side effects (no threads, files or connections),
+# so that settings can be read before the app is created, e.g. in gunicorn.conf.py
+
+
+#############
+# Functions #
+#############
+
+def parse_bool(value: str) -> bool:
+    """
+    Parse a boolean env variable or request parameter value, e.g. "1", "0", "true".
+    Raises ValueError for values that aren't 1/0, true/false, yes/no or on/off.
+    """
+    normalized_value = value.strip().lower()
+    if normalized_value in ("1", "true", "yes", "on"):
+        return True
+    if normalized_value in ("0", "false", "no", "off"):
+        return False
+    raise ValueError(f"Expected a boolean value (1/0, true/false, yes/no, on/off). Received: {value}")
+
+
+def parse_comma_list(value: str) -> tuple[str, ...]:
+    """Parse a comma-separated env variable value."""
+    return tuple(item.strip() for item in value.split(",") if item.strip())
+
+
+def parse_whitespace_list(value: str) -> tuple[str, ...]:
+    """Parse a whitespace-separated env variable value."""
+    return tuple(value.split())
+
+
+def setting(default: object, env: str, parse: Callable[[str], object] = str) -> field:
+    """
+    Dataclass field for a setting that is read from an env variable.
+    :param default: Value to use if the env variable is not set or empty
+    :param env: Name of the env variable
+    :param parse: Function to convert the env variable value
+    :return: dataclasses.Field object
+    """
+    return field(default=default, metadata={"env": env, "parse": parse})
+
+
+###########
+# Classes #
+###########
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    API settings. Resolved once, e.g. from env variables with Settings.from_env, and passed to app.create_app.
+    """
+    # Database
+    sql_path: str = setting("./iris.sql", "SQL_PATH")
+    sql_max_connections: int = setting(8, "SQL_MAX_CONNECTIONS", int)
+    sql_insert_chunk_size: int = setting(sql_operations.DEFAULT_INSERT_CHUNK_SIZE, "SQL_INSERT_CHUNK_SIZE", int)
+    sql_delete_chunk_size: int = setting(sql_operations.DEFAULT_DELETE_CHUNK_SIZE, "SQL_DELETE_CHUNK_SIZE", int)
+    sql_group_commit_rows: int = setting(sql_operations.DEFAULT_GROUP_COMMIT_ROWS, "SQL_GROUP_COMMIT_ROWS", int)
+    sql_write_queue_size: int = setting(sql_operations.DEFAULT_WRITE_QUEUE_SIZE, "SQL_WRITE_QUEUE_SIZE", int)
+    sql_indexed_columns: tuple[str, ...] = setting(
+        tuple(sql_operations.SqlIrisInterface.default_indexed_columns), "SQL_INDEXED_COLUMNS", parse_comma_list)
+    sql_busy_timeout: (int | None) = setting(None, "SQL_BUSY_TIMEOUT", int)        # None: see DEFAULT_PRAGMAS
+    sql_journal_mode: (str | None) = setting(None, "SQL_JOURNAL_MODE")
+    sql_synchronous: (str | None) = setting(None, "SQL_SYNCHRONOUS")
+    query_advisor: bool = setting(False, "QUERY_ADVISOR", parse_bool)
+    slow_query_seconds: float = setting(0.1, "SLOW_QUERY_SECONDS", float)
+    # Cache of GET /iris results. Size 0 disables caching
+    result_cache_size: int = setting(sql_operations.DEFAULT_RESULT_CACHE_SIZE, "RESULT_CACHE_SIZE", int)
+    result_cache_ttl: float = setting(sql_operations.DEFAULT_RESULT_CACHE_TTL, "RESULT_CACHE_TTL", float)
+    result_cache_max_entry_bytes: int = setting(
+        sql_operations.DEFAULT_RESULT_CACHE_MAX_ENTRY_BYTES, "RESULT_CACHE_MAX_ENTRY_BYTES", int)
+    # Sync. Falls back to the single url in DEFAULT_IRIS_DATA_URL, see from_env
+    iris_data_urls: tuple[str, ...] = setting(tuple(), "IRIS_DATA_URLS", parse_whitespace_list)
+    sync_max_downloads: int = setting(sync.DEFAULT_MAX_DOWNLOADS, "SYNC_MAX_DOWNLOADS", int)
+    sync_max_downloads_per_host: int = setting(
+        sync.DEFAULT_MAX_DOWNLOADS_PER_HOST, "SYNC_MAX_DOWNLOADS_PER_HOST", int)
+    job_workers: int = setting(2, "JOB_WORKERS", int)
+    # Logging
+    logger_name: str = setting("root", "LOGGER_NAME")              # Use only names that can also be folder names.
+    log_level: str = setting("INFO", "LOG_LEVEL", str.upper)
+    log_indicator: str = setting(str(), "LOG_INDICATOR")          # Sequence to indicate where to split syslog entries
+    log_queue_size: int = setting(log.DEFAULT_LOG_QUEUE_SIZE, "LOG_QUEUE_SIZE", int)
+    # Flask development server and gunicorn
+    api_host: str = setting("0.0.0.0", "API_HOST")
+    api_port: int = setting(7000, "API_PORT", int)
+    debug: bool = setting(False, "FLASK_DEBUG_MODE", parse_bool)
+    # Gunicorn only: worker processes, threads per worker and request timeout in seconds. See gunicorn.conf.py
+    api_workers: int = setting(2, "API_WORKERS", int)
+    api_threads: int = setting(4, "API_THREADS", int)
+    api_timeout: int = setting(120, "API_TIMEOUT", int)
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] = None, **overrides) -> "Settings":
+        """
+        Read settings from env variables. Unset and empty variables get the default value.
+        :param environ: Mapping of env variables. Defaults to os.environ
+        :param overrides: Settings to use instead of env variables, e.g. sql_path="/tmp/iris.sql"
+        :return: Settings object
+        """
+        environ = os.environ if environ is None else environ
+        values = dict()
+        for setting_field in fields(cls):
+            value = environ.get(setting_field.metadata["env"], str()).strip()
+            if value:
+                values[setting_field.name] = setting_field.metadata["parse"](value)
+        if "iris_data_urls" not in values:
+            values["iris_data_urls"] = parse_whitespace_list(environ.get("DEFAULT_IRIS_DATA_URL", str()))
+        values.update(overrides)
+        return cls(**values)
+
+    @property
+    def sql_pragmas(self) -> dict:
+        """Pragmas for database connections. See sql_operations.get_pragmas"""
+        return sql_operations.get_pragmas(
+            busy_timeout=self.sql_busy_timeout,
+            journal_mode=self.sql_journal_mode,
+            synchronous=self.sql_synchronous)
@@ -1,10 +1,42 @@
 
 # standard
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass
+import functools
+import hashlib
+import itertools
 import os
+import queue
 import re
 import sqlite3
+import threading
+import time
+from typing import Callable, Iterable, Iterator
 # local
-from iris import Iris
+from iris import Iris, IrisBatch
+import log
+
+# Number of rows written per transaction by bulk inserts
+DEFAULT_INSERT_CHUNK_SIZE = 5000
+# Table for keeping track of changes in other tables. See bump_table_version
+VERSION_TABLE = "TableVersion"
+# Table for HTTP cache validators of synced urls. See save_sync_source
+SYNC_SOURCE_TABLE = "SyncSource"
+# Number of distinct compiled "where"-statement combinations to keep in memory
+WHERE_CACHE_SIZE = 1024
+# Write queue: maximum number of rows per group commit and number of batches waiting to be written
+DEFAULT_GROUP_COMMIT_ROWS = 50000
+DEFAULT_WRITE_QUEUE_SIZE = 64
+# Number of rows deleted per transaction by chunked deletes
+DEFAULT_DELETE_CHUNK_SIZE = 5000
+# Query result cache: number of results, seconds to keep them and size of the largest result to cache
+DEFAULT_RESULT_CACHE_SIZE = 256
+DEFAULT_RESULT_CACHE_TTL = 60
+DEFAULT_RESULT_CACHE_MAX_ENTRY_BYTES = 1024 * 1024
+# "where"-statement in the form <column name><operator><value>. Column name is as short as possible.
+WHERE_STATEMENT_PATTERN = re.compile(r"^(?P<column>.+?)(?P<operator>!=|=|<|>|\sin\s)(?P<value>.*)$", re.IGNORECASE)
 
 
 #############
@@ -48,6 +80,39 @@ def create_table(table: str, columns: dict, connection: sqlite3.Connection) -> N
     return
 
 
+def create_index(table: str, columns: list[str], connection: sqlite3.Connection, name: str = None) -> None:
+    """
+    Creates an index on a SQLite table, if it doesn't exist yet. Works as a migration for existing tables
+    :param table: Table name
+    :param columns: Names of the columns to include in the index (in that order)
+    :param connection: SQLite connection object
+    :param name: Index name. Defaults to the table name joined with column names
+    :return: None
+    """
+    name = name or "_".join([table] + columns)
+    sql_cursor = connection.cursor()
+    sql_cursor.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS {name}
+            ON {table} ({",".join(columns)});
+        """)
+    connection.commit()
+    return
+
+
+def explain_query_plan(table: str, connection: sqlite3.Connection, where: tuple) -> list[str]:
+    """
+    Get SQLite query plan for filtering a table with a "where"-statement. Shows whether indexes are used.
+    :param table: Name of table
+    :param connection: SQLite connection object
+    :param where: Compiled "where"-statement in the form (where string, values). See compile_where_statement
+    :return: List of query plan steps. E.g. ["SEARCH Iris USING INDEX Iris_species (species=?)"]
+    """
+    sql_cursor = connection.cursor()
+    response = sql_cursor.execute(f"EXPLAIN QUERY PLAN SELECT rowid FROM {table}{where[0]};", where[1])
+    return [step[-1] for step in response.fetchall()]           # Last element is the step description
+
+
 def insert_row(table: str, connection: sqlite3.Connection, **kwargs) -> int:
     """
     Inserts a single row to a SQLite table
@@ -77,45 +142,70 @@ def insert_row(table: str, connection: sqlite3.Connection, **kwargs) -> int:
     return sql_cursor.rowcount
 
 
+def insert_rows(table: str, connection: sqlite3.Connection, column_names: list[str], rows: Iterable[tuple],
+                unique: bool = False, commit: bool = True) -> int:
+    """
+    Inserts multiple rows to a SQLite table with a single executemany statement
+    :param table: Name of the table to insert to
+    :param connection: SQLite connection object
+    :param column_names: Names of the columns to insert to
+    :param rows: Iterable of value tuples. Values have to be in the same order as column_names
+    :param unique: Skip rows that already exist in the table (i.e. all columns match) or earlier in the input.
+    Lookups are fast only if there's an index on the columns (see SqlTableInterface).
+    :param commit: Commit after inserting. If False, the insert is left in an open transaction
+    :return: Number of rows inserted
+    """
+    sql_cursor = connection.cursor()
+    column_names_string = ",".join(column_names)
+    # Numbered placeholders, so that the values can be used in both SELECT and WHERE. E.g. ?1, ?2, ?3
+    placeholders = [f"?{i}" for i in range(1, len(column_names) + 1)]
+    placeholder_string = ", ".join(placeholders)
+
+    if unique:
+        # Same effect as INSERT OR IGNORE with a unique index, but allows duplicates from non-unique inserts
+        match_string = " AND ".join([f"{column} IS {placeholder}"
+                                     for column, placeholder in zip(column_names, placeholders)])
+        sql_statement = f"""
+            INSERT INTO {table}
+                ({column_names_string})
+            SELECT {placeholder_string}
+            WHERE NOT EXISTS
+                (SELECT 1 FROM {table} WHERE {match_string});
+            """
+    else:
+        sql_statement = f"""
+            INSERT INTO {table}
+                ({column_names_string})
+            VALUES
+                ({placeholder_string});
+            """
+    sql_cursor.executemany(sql_statement, rows)
+    if commit:
+        connection.commit()
+    return max(sql_cursor.rowcount, 0)             # rowcount is -1 if rows was empty
+
+
 def parse_where_parameter(statement: str) -> tuple:
     """
     Take a single SQL-like "where"-statement and parse it to components.
     E.g. "column_name < 99" --> ("column_name", "<", "99")
     Supported operators: =, !=, <, >, IN
+    The column name is everything before the first operator and the value is everything after it.
     :return: A tuple with the following values: (column_name, operator, value)
     """
-    operators = ["=", "!=", "<", ">", r"\sin\s"]
-    operators_pattern = '|'.join(operators)
     statement = statement.strip()
-
-    column_pattern = re.compile(rf"^.+?(?=({operators_pattern}))", re.IGNORECASE)
-    column_match = column_pattern.search(statement)
-    if column_match:
-        column = column_match.group(0).strip()
-    else:
-        raise ValueError(
-            f"Can't parse the column name from the where statement. "
-            f"Problematic statement: '{statement}'")
-
-    operator_pattern = re.compile(operators_pattern, re.IGNORECASE)
-    operator_match = operator_pattern.search(statement)
-    if operator_match:
-        operator_raw = operator_match.group(0)
-        operator = operator_raw.strip()
-    else:
+    statement_match = WHERE_STATEMENT_PATTERN.search(statement)
+    if not statement_match:
         raise ValueError(
-            f"Can't parse the operator part from the where statement. "
+            f"Can't parse the column name, operator and value from the where statement. "
             f"Problematic statement: '{statement}'")
-
-    value_pattern = re.compile(rf"^.+?{operator_raw}(.+$)", re.IGNORECASE)
-    value_match = value_pattern.search(statement)
-    if value_match:
-        value = value_match.group(1).strip()
-    else:
+    column = statement_match.group("column").strip()
+    operator = statement_match.group("operator").strip()
+    value = statement_match.group("value").strip()
+    if not value:
         raise ValueError(
             f"Can't parse a searchable value from the where statement. "
             f"Problematic statement: '{statement}'")
-
     return column, operator, value
 
 
@@ -167,23 +257,74 @@ def compile_where_statement(parsed_inputs: list[tuple]) -> tuple[str, list]:
     return where_string, values
 
 
-def read_table(table: str, connection: sqlite3.Connection, where: tuple = None) -> list[dict]:
+@functools.lru_cache(maxsize=WHERE_CACHE_SIZE)
+def compile_where(statements: tuple[str, ...], columns: tuple[str, ...]) -> tuple[str, tuple]:
+    """
+    Parse and compile "where"-statements. Results are cached, so repeated filters skip parsing and typecasting.
+    Column names are validated, since they are formatted into the SQL string.
+    E.g. ("column1<99", "column2 IN (a,b)") --> (" WHERE column1 < ? AND column2 IN (?,?)", (99, "a", "b"))
+    :param statements: Raw "where"-statements. Tuple, since the input has to be hashable.
+    :param columns: Names of columns that are allowed in the statements
+    :return: A tuple in the form ("where"-string formatted with placeholders, tuple of corresponding values)
+    """
+    where_parsed = [parse_where_parameter(statement) for statement in statements]
+    unknown_columns = [column for column, _, _ in where_parsed if column not in columns]
+    if unknown_columns:
+        raise ValueError(
+            f"Unknown columns in where statement: {', '.join(unknown_columns)}. "
+            f"Available columns: {', '.join(columns)}")
+    where_string, where_values = compile_where_statement(where_parsed)
+    return where_string, tuple(where_values)
+
+
+def query_table(table: str, connection: sqlite3.Connection, where: tuple = None, columns: list[str] = None,
+                after: int = None, limit: int = None) -> sqlite3.Cursor:
+    """
+    Run a select query on a SQLite table and return the cursor, so that rows can be fetched incrementally.
+    If "after" or "limit" is given, rows are ordered by rowid (keyset pagination).
+    :param table: Name of table
+    :param connection: SQLite connection object
+    :param where: Compiled "where"-statement in the form (where string, values). See compile_where_statement
+    :param columns: Names of columns to select. All columns if not given
+    :param after: Only return rows with rowid greater than this value
+    :param limit: Maximum number of rows to return
+    :return: sqlite3 Cursor object for the executed query. Column names are in cursor.description
+    """
+    sql_cursor = connection.cursor()
+    columns_string = ",".join(columns) if columns else "*"
+    where_string, where_values = where if where else (str(), list())
+    if after is not None:
+        where_string = f"{where_string} AND rowid > ?" if where_string else " WHERE rowid > ?"
+        where_values = [*where_values, after]
+    sql_statement = f"SELECT {columns_string} FROM {table}{where_string}"
+    if after is not None or limit is not None:
+        sql_statement += " ORDER BY rowid"
+    if limit is not None:
+        sql_statement += " LIMIT ?"
+        where_values = [*where_values, limit]
+    response = sql_cursor.execute(f"{sql_statement};", where_values)
+    return response
+
+
+def read_table(table: str, connection: sqlite3.Connection, where: tuple = None, columns: list[str] = None,
+               after: int = None, limit: int = None) -> list[dict]:
     """
     Get rows from SQLite table. If no "where" argument is supplied, returns all data from table
     :param table: Name of table
     :param connection: SQLite connection object
     :param where: SQL-like "where"-statement. See sql_operations.parse_where_parameter for supported operators
+    :param columns: Names of columns to select. All columns if not given
+    :param after: Only return rows with rowid greater than this value
+    :param limit: Maximum number of rows to return
     :return: List of dicts corresponding to the rows returned in the form of {column_name: value, ...}
     """
-    sql_cursor = connection.cursor()
-    # Add where statement values, if given
-    sql_statement = f"SELECT * FROM {table};"
-    where_values = tuple()
-    if where:
-        sql_statement = sql_statement.replace(";", f"{where[0]};")
-        where_values = where[1]
-    # Execute query
-    response = sql_cursor.execute(sql_statement, where_values)
+    response = query_table(
+        table=table,
+        connection=connection,
+        where=where,
+        columns=columns,
+        after=after,
+        limit=limit)
     data = response.fetchall()
     # Format the response as a list of dicts
     data_column_names = [item[0] for item in response.description]
@@ -194,31 +335,189 @@ def read_table(table: str, connection: sqlite3.Connection, where: tuple = None)
     return data_rows
 
 
-def delete_rows(table: str, connection: sqlite3.Connection, where: tuple = 0) -> int:
+def get_page_end(table: str, connection: sqlite3.Connection, where: tuple = None, after: int = None,
+                 limit: int = None) -> (int | None):
+    """
+    Get the rowid of the last row of a page in keyset pagination. Used as the "after" value for the next page.
+    Should be run in the same read transaction as the page query (see begin_read), so that both see the same rows.
+    :param table: Name of table
+    :param connection: SQLite connection object
+    :param where: Compiled "where"-statement in the form (where string, values). See compile_where_statement
+    :param after: rowid that the page starts after
+    :param limit: Page size
+    :return: rowid of the last row of the page. None if there are no rows after the page.
+    """
+    if not limit:
+        return None
+    where_string, where_values = where if where else (str(), list())
+    if after is not None:
+        where_string = f"{where_string} AND rowid > ?" if where_string else " WHERE rowid > ?"
+        where_values = [*where_values, after]
+    sql_cursor = connection.cursor()
+    # Last row of the page and the first row after it. Page end is only returned if there is a next row
+    response = sql_cursor.execute(
+        f"SELECT rowid FROM {table}{where_string} ORDER BY rowid LIMIT 2 OFFSET ?;",
+        [*where_values, limit - 1])
+    rowids = response.fetchall()
+    return rowids[0][0] if len(rowids) == 2 else None
+
+
+def delete_rows(table: str, connection: sqlite3.Connection, where: tuple = 0, commit: bool = True,
+                after: int = None, until: int = None) -> int:
     """
     Delete rows from SQLite table. If no "where" argument is supplied, no action is taken
     :param table: Name of table
     :param connection: SQLite connection object
     :param where: SQL-like "where"-statement. See sql_operations.parse_where_parameter for supported operators
+    :param commit: Commit after deleting. If False, the delete is left in an open transaction
+    :param after: Only delete rows with rowid greater than this value (for deleting in chunks)
+    :param until: Only delete rows with rowid less than or equal to this value
     :return: Number of rows deleted
     """
     sql_cursor = connection.cursor()
     if isinstance(where, tuple) and len(where) > 1:             # Use parsed where statement if provided
-        sql_statement = f"DELETE FROM {table} {where[0]};"
-        where_values = where[1]
+        sql_statement = f"DELETE FROM {table} {where[0]}"
+        where_values = list(where[1])
     elif where:                                                 # If where = True, delete all
-        sql_statement = f"DELETE FROM {table};"
-        where_values = tuple()
+        sql_statement = f"DELETE FROM {table}"
+        where_values = list()
     else:                                                       # Default where input 0: no action
-        sql_statement = f"DELETE FROM {table} WHERE 0;"
-        where_values = tuple()
+        sql_statement = f"DELETE FROM {table} WHERE 0"
+        where_values = list()
+    for condition, value in (("rowid > ?", after), ("rowid <= ?", until)):
+        if value is not None:
+            sql_statement += f" AND {condition}" if " WHERE " in sql_statement else f" WHERE {condition}"
+            where_values += [value]
+    sql_statement += ";"
 
     response = sql_cursor.execute(sql_statement, where_values)
     n_deleted_rows = response.rowcount
-    connection.commit()
+    if commit:
+        connection.commit()
     return n_deleted_rows
 
 
+def get_table_version(table: str, connection: sqlite3.Connection) -> int:
+    """
+    Get the current version of a table. See bump_table_version
+    :param table: Name of table
+    :param connection: SQLite connection object
+    :return: Table version. 0 if the table hasn't been changed through a versioned write yet.
+    """
+    sql_cursor = connection.cursor()
+    response = sql_cursor.execute(f"SELECT version FROM {VERSION_TABLE} WHERE table_name = ?;", (table,))
+    version = response.fetchone()
+    return version[0] if version else 0
+
+
+def bump_table_version(table: str, connection: sqlite3.Connection, n_changes: int) -> int:
+    """
+    Increase table version by the number of changed rows. Doesn't commit.
+    Meant to be run in the same transaction as the changes, so that the version is updated atomically with the data.
+    Since the writing connection holds the write lock until commit, the version before the changes
+    is always the returned version minus n_changes.
+    :param table: Name of table
+    :param connection: SQLite connection object
+    :param n_changes: Number of rows that were inserted or deleted
+    :return: New table version
+    """
+    sql_cursor = connection.cursor()
+    sql_cursor.execute(
+        f"""
+        INSERT INTO {VERSION_TABLE} (table_name, version)
+        VALUES (?, ?)
+        ON CONFLICT (table_name) DO UPDATE SET version = version + excluded.version;
+        """,
+        (table, n_changes))
+    return get_table_version(table, connection)
+
+
+def create_sync_source_table(connection: sqlite3.Connection) -> None:
+    """Create the table for sync source state, if it doesn't exist. See save_sync_source"""
+    create_table(
+        table=SYNC_SOURCE_TABLE,
+        columns={"url": "TEXT PRIMARY KEY", "etag": "TEXT", "last_modified": "TEXT"},
+        connection=connection)
+
+
+def get_sync_source(url: str, connection: sqlite3.Connection) -> (dict | None):
+    """
+    Get the state of the last successful sync from an url.
+    :param url: Source url
+    :param connection: SQLite connection object
+    :return: Dict with keys etag and last_modified. None if the url hasn't been synced yet.
+    """
+    sql_cursor = connection.cursor()
+    response = sql_cursor.execute(
+        f"SELECT etag, last_modified FROM {SYNC_SOURCE_TABLE} WHERE url = ?;", (url,))
+    row = response.fetchone()
+    if row is None:
+        return None
+    return dict(zip(("etag", "last_modified"), row))
+
+
+def save_sync_source(url: str, connection: sqlite3.Connection, etag: str = None, last_modified: str = None,
+                     commit: bool = True) -> None:
+    """
+    Save the state of a successful sync from an url.
+    Lets the next sync send a conditional request and skip parsing content that hasn't changed.
+    :param url: Source url
+    :param connection: SQLite connection object
+    :param etag: ETag header of the source response
+    :param last_modified: Last-Modified header of the source response
+    :param commit: Commit the transaction. Otherwise, the caller is responsible for committing.
+    :return: None
+    """
+    sql_cursor = connection.cursor()
+    sql_cursor.execute(
+        f"""
+        INSERT INTO {SYNC_SOURCE_TABLE} (url, etag, last_modified)
+        VALUES (?, ?, ?)
+        ON CONFLICT (url) DO UPDATE SET
+            etag = excluded.etag, last_modified = excluded.last_modified;
+        """,
+        (url, etag, last_modified))
+    if commit:
+        connection.commit()
+
+
+def save_sync_sources(sources: dict[str, tuple], connection: sqlite3.Connection, expected_version: int) -> bool:
+    """
+    Save the state of several successful syncs in a single transaction, unless sync state has been cleared
+    since expected_version (see get_sync_sources_version), e.g. because rows were deleted while the syncs ran.
+    :param sources: {url: (etag, last_modified)}
+    :param connection: SQLite connection object
+    :param expected_version: Sync sources version read before the syncs started
+    :return: True if the state was saved
+    """
+    for url, (etag, last_modified) in sources.items():
+        save_sync_source(url=url, connection=connection, etag=etag, last_modified=last_modified, commit=False)
+    # Connection holds the write lock since the first save, so the state can't be cleared between check and commit
+    if get_sync_sources_version(connection) != expected_version:
+        connection.rollback()
+        return False
+    connection.commit()
+    return True
+
+
+def get_sync_sources_version(connection: sqlite3.Connection) -> int:
+    """Number of times the sync state has been cleared. See clear_sync_sources"""
+    return get_table_version(SYNC_SOURCE_TABLE, connection)
+
+
+def clear_sync_sources(connection: sqlite3.Connection, commit: bool = True) -> None:
+    """
+    Forget the state of all synced urls, so that the next syncs download and insert everything again.
+    Needed when synced rows may have been deleted. Increases the sync sources version,
+    so that syncs running at the same time don't save their state (see save_sync_sources).
+    """
+    sql_cursor = connection.cursor()
+    sql_cursor.execute(f"DELETE FROM {SYNC_SOURCE_TABLE};")
+    bump_table_version(SYNC_SOURCE_TABLE, connection, 1)
+    if commit:
+        connection.commit()
+
+
 def get_columns(table: str, connection: sqlite3.Connection) -> dict:
     """
     Get column names of a SQLite table
@@ -237,38 +536,99 @@ def get_columns(table: str, connection: sqlite3.Connection) -> dict:
     return columns
 
 
-def get_table_summary(rows: list) -> dict[dict]:
+def summarize_table(table: str, columns: dict, connection: sqlite3.Connection) -> dict[dict]:
     """
-    Get summary of each column in a table.
+    Get summary of each column in a table, calculated by SQLite in a single query.
     Always gives the type of column and the number of total values and unique values.
-    If the column type is numeric, includes minimum, maximum and median
-    :param rows: A table represented as a list of dicts.
+    If the column type is numeric, includes minimum, maximum and median (unless the table is empty)
+    :param table: Name of table
+    :param columns: A dict in the form of {column name: python type name}
+    :param connection: SQLite connection object
     :return: A nested summary dict in the following form:
     {column1: {type: str, n_total_values: 10, ...}, column2: {type: int, n_total_values: 22, ...}, ...}
     """
-    if not rows:
-        return dict()
-    reference_object = rows[0]
-    instance_variables = vars(reference_object)
-    # Use class annotations to be able to handle reference objects where some variables are not set.
-    class_annotations = list(reference_object.__class__.__annotations__.items())
-    # Null table: table with only column names and empty values.
-    null_table = len(rows) == 1 and not any([bool(value) for value in instance_variables.values()])
+    numeric_types = ("int", "float")
+    aggregates = list()             # (column name, summary key, SQL expression)
+    for column_name, column_type in columns.items():
+        aggregates += [
+            (column_name, "n_total_values", f"COUNT({column_name})"),
+            (column_name, "n_unique_values", f"COUNT(DISTINCT {column_name})")]
+        if column_type in numeric_types:
+            # Median is the average of the middle value (odd count) or the two middle values (even count)
+            n_values = f"(SELECT COUNT({column_name}) FROM {table})"
+            median = f"""
+                (SELECT AVG(value) FROM
+                    (SELECT {column_name} AS value FROM {table}
+                    WHERE {column_name} IS NOT NULL
+                    ORDER BY {column_name}
+                    LIMIT 2 - {n_values} % 2
+                    OFFSET ({n_values} - 1) / 2))"""
+            aggregates += [
+                (column_name, "minimum", f"MIN({column_name})"),
+                (column_name, "maximum", f"MAX({column_name})"),
+                (column_name, "median", median)]
 
+    sql_cursor = connection.cursor()
+    sql_statement = f"SELECT {','.join([expression for _, _, expression in aggregates])} FROM {table};"
+    result = sql_cursor.execute(sql_statement).fetchone()
+
+    summary = {column_name: {"type": column_type} for column_name, column_type in columns.items()}
+    for (column_name, key, _), value in zip(aggregates, result):
+        if key in ("minimum", "maximum", "median") and not summary[column_name]["n_total_values"]:
+            continue                # No numeric statistics for columns without values
+        summary[column_name][key] = value
+    return summary
+
+
+def count_values(table: str, columns: list[str], connection: sqlite3.Connection) -> dict[Counter]:
+    """
+    Count the occurrences of each distinct value in table columns. NULL values are not counted.
+    :param table: Name of table
+    :param columns: Names of columns to count values in
+    :param connection: SQLite connection object
+    :return: Dict in the form {column name: Counter({value: count, ...}), ...}
+    """
+    sql_cursor = connection.cursor()
+    value_counts = dict()
+    for column_name in columns:
+        response = sql_cursor.execute(
+            f"SELECT {column_name}, COUNT(*) FROM {table} WHERE {column_name} IS NOT NULL GROUP BY {column_name};")
+        value_counts[column_name] = Counter(dict(response.fetchall()))
+    return value_counts
+
+
+def summarize_value_counts(value_counts: dict[Counter], columns: dict) -> dict[dict]:
+    """
+    Get the same summary as summarize_table, but from counts of values (see count_values)
+    :param value_counts: Dict in the form {column name: Counter({value: count, ...}), ...}
+    :param columns: A dict in the form of {column name: python type name}
+    :return: A nested summary dict in the form {column1: {type: str, n_total_values: 10, ...}, ...}
+    """
+    numeric_types = ("int", "float")
     summary = dict()
-    for column_name, column_type in class_annotations:
-        column_summary = dict()
-        column_summary["type"] = column_type.__name__
-        column_summary["n_total_values"] = 0        # Assume zero and overwrite later if not
-        column_summary["n_unique_values"] = 0       # Assume zero and overwrite later if not
-        if not null_table:
-            values = [getattr(row, column_name) for row in rows]
-            column_summary["n_total_values"] = len([value for value in values if value is not None])
-            column_summary["n_unique_values"] = len(set(values))
-            if column_type in (int, float):
-                column_summary["minimum"] = sorted(values)[0]
-                column_summary["maximum"] = sorted(values)[-1]
-                column_summary["median"] = (sorted(values)[len(values) // 2] + sorted(values)[~len(values) // 2]) / 2
+    for column_name, column_type in columns.items():
+        counts = value_counts[column_name]
+        n_total_values = sum(counts.values())
+        column_summary = {
+            "type": column_type,
+            "n_total_values": n_total_values,
+            "n_unique_values": len(counts)}
+        if column_type in numeric_types and n_total_values:
+            sorted_values = sorted(counts)
+            # Find the two middle positions (the same position if count is odd) by walking the cumulative counts
+            middle_positions = [(n_total_values - 1) // 2, n_total_values // 2]
+            middle_values = list()
+            n_passed = 0
+            for value in sorted_values:
+                n_passed += counts[value]
+                while middle_positions and middle_positions[0] < n_passed:
+                    middle_values += [value]
+                    middle_positions.pop(0)
+                if not middle_positions:
+                    break
+            column_summary["minimum"] = sorted_values[0]
+            column_summary["maximum"] = sorted_values[-1]
+            column_summary["median"] = (middle_values[0] + middle_values[1]) / 2
         summary[column_name] = column_summary
     return summary
 
@@ -298,20 +658,387 @@ def get_python_type(sql_type: str, blob_type: str = str) -> type:
     return python_type_reference.get(sql_type.upper(), blob_type)
 
 
-def get_connection(path: str) -> sqlite3.Connection:
+def get_connection(path: str, check_same_thread: bool = True) -> sqlite3.Connection:
     """
     Get SQLite connection to a given database path.
     If database doesn't exist, creates a new database and path directories to it (unless path is :memory:).
     :param path: Path to SQLite database
+    :param check_same_thread: If False, the connection can be used by other threads than the one that created it
     :return: sqlite3 Connection object to input path
     """
     if path != ":memory:":
-        if not os.path.exists(os.path.dirname(path)):
-            os.makedirs(os.path.dirname(path))
-    connection = sqlite3.connect(path)
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+    connection = sqlite3.connect(path, check_same_thread=check_same_thread)
     return connection
 
 
+def begin_read(connection: sqlite3.Connection) -> None:
+    """
+    Start a read transaction, so that the following queries see the same snapshot of the database,
+    e.g. a page and the cursor for the next page. Ends with commit or rollback, e.g. when a pooled connection
+    is released. In WAL journal mode, writers don't have to wait for it.
+    :param connection: SQLite connection object
+    :return: None
+    """
+    if not connection.in_transaction:
+        connection.execute("BEGIN;")
+
+
+def apply_pragmas(connection: sqlite3.Connection, pragmas: dict) -> None:
+    """
+    Apply connection-level settings to a SQLite connection
+    :param connection: SQLite connection object
+    :param pragmas: Dict in the form {pragma name: value}. E.g. {"busy_timeout": 5000}
+    :return: None
+    """
+    sql_cursor = connection.cursor()
+    for pragma, value in pragmas.items():
+        sql_cursor.execute(f"PRAGMA {pragma} = {value};")
+    return
+
+
+###################
+# Connection pool #
+###################
+
+# Pragmas applied to every pooled connection. Busy timeout is applied first, so that it covers the other pragmas
+DEFAULT_PRAGMAS = {
+    "busy_timeout": 5000,               # Milliseconds to wait for a lock before failing with "database is locked"
+    "journal_mode": "WAL",              # Readers don't block the writer and vice versa. Persistent in database file
+    "synchronous": "NORMAL",            # With WAL, fsync only at checkpoints. Committed data survives app crashes
+    "temp_store": "MEMORY"}             # Keep temporary tables and indexes (e.g. for sorting) in memory
+
+
+def get_pragmas(busy_timeout: int = None, journal_mode: str = None, synchronous: str = None) -> dict:
+    """
+    Get pragmas for pooled connections: DEFAULT_PRAGMAS, with the given values replaced.
+    :param busy_timeout: Milliseconds to wait for a lock
+    :param journal_mode: SQLite journal mode, e.g. WAL or DELETE
+    :param synchronous: SQLite synchronous setting, e.g. NORMAL or FULL
+    :return: Dict in the form {pragma name: value}
+    """
+    pragmas = dict(DEFAULT_PRAGMAS)
+    overrides = {"busy_timeout": busy_timeout, "journal_mode": journal_mode, "synchronous": synchronous}
+    pragmas.update({pragma: value for pragma, value in overrides.items() if value is not None})
+    return pragmas
+
+
+class ConnectionPool:
+    """
+    Process-wide pool of SQLite connections to a single database.
+    Connections are opened on demand, configured with pragmas once and then reused by all requests.
+    The bootstrap callable (e.g. table creation) is run only once per pool, before the first connection is handed out.
+
+    Instance attributes:
+    path: Path to SQLite database
+    pragmas: Dict of pragmas to apply on each new connection. {pragma name: value}
+    max_connections: Maximum number of connections that can be borrowed at the same time
+    timeout: Seconds to wait for a free connection before raising sqlite3.OperationalError
+    bootstrap: Callable that takes a sqlite3 Connection object and prepares the database schema
+    """
+
+    def __init__(self, path: str, pragmas: dict = None, max_connections: int = 8, timeout: float = 30,
+                 bootstrap: Callable[[sqlite3.Connection], None] = None) -> None:
+        self.path = path
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.bootstrap = bootstrap
+        self._idle_connections = queue.LifoQueue()          # Most recently used connection first
+        self._free_slots = threading.BoundedSemaphore(max_connections)
+        self._bootstrap_lock = threading.Lock()
+        self._bootstrapped = bootstrap is None
+
+    def _open_connection(self) -> sqlite3.Connection:
+        """Open a new connection that can be passed between threads and apply pragmas to it."""
+        connection = get_connection(self.path, check_same_thread=False)
+        apply_pragmas(connection, self.pragmas)
+        return connection
+
+    def _run_bootstrap(self, connection: sqlite3.Connection) -> None:
+        """Run bootstrap callable once. Not marked as done if it fails, so that it's retried with the next request."""
+        with self._bootstrap_lock:
+            if not self._bootstrapped:
+                self.bootstrap(connection)
+                self._bootstrapped = True
+
+    def acquire(self) -> sqlite3.Connection:
+        """
+        Borrow a connection from the pool. Has to be returned by ConnectionPool.release.
+        Opens a new connection if there are no idle connections and the pool isn't full.
+        :return: sqlite3 Connection object
+        """
+        if not self._free_slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError(f"No free database connections after waiting {self.timeout} seconds.")
+        try:
+            try:
+                connection = self._idle_connections.get_nowait()
+            except queue.Empty:
+                connection = self._open_connection()
+            if not self._bootstrapped:
+                self._run_bootstrap(connection)
+        except BaseException:
+            self._free_slots.release()
+            raise
+        return connection
+
+    def release(self, connection: sqlite3.Connection) -> None:
+        """Return a borrowed connection to the pool. Uncommitted changes are rolled back."""
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+            self._idle_connections.put(connection)
+        finally:
+            self._free_slots.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Context manager for borrowing a connection. Returns it to the pool on exit."""
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self) -> None:
+        """Close all idle connections. Borrowed connections are not affected."""
+        while True:
+            try:
+                connection = self._idle_connections.get_nowait()
+            except queue.Empty:
+                break
+            connection.close()
+
+
+#################
+# Query advisor #
+#################
+
+class QueryAdvisor:
+    """
+    Collects statistics about filtered queries, to help decide which indexes to keep.
+    Counts how often each column is used in "where"-statements and logs the counts every report_interval queries.
+    Queries that take longer than slow_query_seconds are logged together with their query plan.
+
+    Instance attributes:
+    slow_query_seconds: Duration threshold for logging a query as slow
+    report_interval: Number of filtered queries between column usage reports
+    column_usage: Counter with the number of "where"-statements for each column
+    """
+
+    def __init__(self, slow_query_seconds: float = 0.1, report_interval: int = 1000) -> None:
+        self.slow_query_seconds = slow_query_seconds
+        self.report_interval = report_interval
+        self.column_usage = Counter()
+        self._n_queries = 0
+        self._lock = threading.Lock()
+
+    def record(self, table: str, connection: sqlite3.Connection, statements: list[str], where: tuple,
+               duration: float) -> None:
+        """
+        Record a filtered query
+        :param table: Name of table
+        :param connection: SQLite connection object. Used for getting the query plan of slow queries
+        :param statements: Raw "where"-statements
+        :param where: Compiled "where"-statement in the form (where string, values)
+        :param duration: Query duration in seconds
+        :return: None
+        """
+        columns = [parse_where_parameter(statement)[0] for statement in statements]
+        with self._lock:
+            self.column_usage.update(columns)
+            self._n_queries += 1
+            column_usage = self.column_usage.most_common() if self._n_queries % self.report_interval == 0 else None
+        if duration >= self.slow_query_seconds:
+            log_entry = log.SlowQuery(
+                exception=Warning(),
+                table=table,
+                where=where[0],
+                duration=duration,
+                query_plan=explain_query_plan(table, connection, where))
+            log_entry.record("WARNING")
+        if column_usage:
+            log_entry = log.ColumnUsage(
+                exception=Warning(),
+                table=table,
+                column_usage=column_usage)
+            log_entry.record("INFO")
+
+
+#################
+# Summary cache #
+#################
+
+class SummaryCache:
+    """
+    Process-wide cache of a table summary, kept up to date by writes through SqlTableInterface.
+    Keeps counts of each distinct value per column, so that inserted rows can be added incrementally and the summary
+    is served without querying the table. Memory use is proportional to the number of distinct values.
+    The cache is tied to a table version (see bump_table_version). Reads check the version,
+    so that deletes and changes made by other processes cause a reload on the next read.
+
+    Instance attributes:
+    columns: A dict in the form of {column name: python type name}
+    """
+
+    def __init__(self, columns: dict) -> None:
+        self.columns = columns
+        self._lock = threading.Lock()
+        self._version = None                # Table version that the cached values correspond to. None if not loaded
+        self._value_counts = dict()         # {column name: Counter({value: count})}
+        self._summary = None                # Summary calculated from value counts. None if not calculated yet
+
+    def get(self, table: str, connection: sqlite3.Connection) -> dict[dict]:
+        """
+        Get table summary. Reloads value counts from the table only if the table version has changed.
+        The returned dict is shared between callers and shouldn't be modified.
+        :param table: Name of table
+        :param connection: SQLite connection object
+        :return: A nested summary dict. See summarize_table
+        """
+        version = get_table_version(table, connection)
+        with self._lock:
+            if self._version != version:
+                self._value_counts = count_values(table, list(self.columns), connection)
+                self._summary = None
+                self._version = version
+            if self._summary is None:
+                self._summary = summarize_value_counts(self._value_counts, self.columns)
+            return self._summary
+
+    def add(self, rows: list[tuple], n_rows_inserted: int, version: int) -> None:
+        """
+        Add inserted rows to the cached values.
+        Applied only if the rows are the only change since the cached version, otherwise the cache is invalidated.
+        :param rows: Value tuples, in the same order as the cache columns
+        :param n_rows_inserted: Number of rows that were actually inserted (can be less than rows on unique inserts)
+        :param version: Table version after the insert
+        :return: None
+        """
+        with self._lock:
+            if self._version is None or self._version != version - n_rows_inserted or n_rows_inserted != len(rows):
+                self._version = None            # Can't tell which rows were inserted - reload on next read
+                return
+            for column_name, values in zip(self.columns, zip(*rows)):
+                self._value_counts[column_name].update(value for value in values if value is not None)
+            self._summary = None
+            self._version = version
+
+
+######################
+# Query result cache #
+######################
+
+@dataclass
+class DeleteStats:
+    """Progress of a chunked delete. Updated after each committed chunk."""
+    n_rows_deleted: int = 0
+    n_chunks: int = 0
+    seconds: float = 0
+
+
+@dataclass(frozen=True)
+class CachedResult:
+    """Serialized query result, valid for a single table version"""
+    version: int                    # Table version that the result was queried at
+    body: bytes                     # Serialized result, e.g. a json response body
+    etag: str                       # Fingerprint of body, for http ETag header
+    next_cursor: (int | None)       # Pagination cursor for the next page. None on the last page
+    stored: float                   # time.monotonic() when the result was stored
+
+
+class QueryResultCache:
+    """
+    Process-wide LRU cache of serialized query results, with a time to live.
+    Results are tied to the table version at the time of the query (see bump_table_version).
+    Reads check the version, so that writes by this or other processes invalidate the results.
+    Keys should be normalized queries, so that equivalent requests share a result.
+
+    Instance attributes:
+    max_entries: Maximum number of results to keep. 0 disables caching (results still get an ETag)
+    ttl_seconds: Seconds that a result is kept, even if the table doesn't change
+    max_entry_bytes: Larger results are not cached
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_RESULT_CACHE_SIZE, ttl_seconds: float = DEFAULT_RESULT_CACHE_TTL,
+                 max_entry_bytes: int = DEFAULT_RESULT_CACHE_MAX_ENTRY_BYTES) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_entry_bytes = max_entry_bytes
+        self._lock = threading.Lock()
+        self._results = OrderedDict()       # {key: CachedResult}. Least recently used first
+        self._n_bytes = 0
+        self._counts = Counter()            # Hits, misses and removed results by reason
+
+    def get(self, key: tuple, version: int) -> (CachedResult | None):
+        """
+        Get a cached result. Results for other table versions and expired results are removed.
+        :param key: Normalized query, e.g. (table name, compiled where-statement, columns, after, limit)
+        :param version: Current table version. See get_table_version
+        :return: CachedResult object, or None if there is no valid result
+        """
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None and result.version != version:
+                self._remove(key, reason="invalidated")
+                result = None
+            elif result is not None and time.monotonic() - result.stored > self.ttl_seconds:
+                self._remove(key, reason="expired")
+                result = None
+            if result is None:
+                self._counts["misses"] += 1
+                return None
+            self._results.move_to_end(key)
+            self._counts["hits"] += 1
+            return result
+
+    def put(self, key: tuple, version: int, body: bytes, next_cursor: int = None) -> CachedResult:
+        """
+        Store a result. The version should be read before running the query,
+        so that a write during the query can only make the result look older than it is.
+        :param key: Normalized query. See get
+        :param version: Table version read before the query
+        :param body: Serialized result
+        :param next_cursor: Pagination cursor for the next page
+        :return: CachedResult object, also if the result is not cached (e.g. caching is disabled or it's too large)
+        """
+        etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        result = CachedResult(version=version, body=body, etag=etag, next_cursor=next_cursor, stored=time.monotonic())
+        if self.max_entries < 1 or len(body) > self.max_entry_bytes:
+            return result
+        with self._lock:
+            if key in self._results:
+                self._remove(key, reason="replaced")
+            self._results[key] = result
+            self._n_bytes += len(body)
+            while len(self._results) > self.max_entries:
+                self._remove(next(iter(self._results)), reason="evicted")
+        return result
+
+    def _remove(self, key: tuple, reason: str) -> None:
+        """Remove a result and count the reason. Lock has to be held by the caller."""
+        self._n_bytes -= len(self._results.pop(key).body)
+        self._counts[reason] += 1
+
+    def stats(self) -> dict:
+        """Hit and miss counts, hit ratio, removed results by reason and current size."""
+        with self._lock:
+            counts = Counter(self._counts)
+            n_results, n_bytes = len(self._results), self._n_bytes
+        n_requests = counts["hits"] + counts["misses"]
+        return {
+            "hits": counts["hits"],
+            "misses": counts["misses"],
+            "hit_ratio": counts["hits"] / n_requests if n_requests else None,
+            "invalidated": counts["invalidated"],
+            "expired": counts["expired"],
+            "evicted": counts["evicted"],
+            "entries": n_results,
+            "bytes": n_bytes}
+
+
 ############################
 # SQLite interface classes #
 ############################
@@ -319,23 +1046,71 @@ def get_connection(path: str) -> sqlite3.Connection:
 class SqlTableInterface:
     """
     Interface class for SQLite operations on a single table.
-    Connects to an existing table or creates it if it doesn't exist.
+    Connects to an existing table or creates it if it doesn't exist (unless create=False).
+    Also creates a content index over all columns, which is used to find existing rows on unique inserts.
+    Writes through the interface increase the table version (see bump_table_version) in the same transaction.
 
     Instance attributes:
     name: Table name in SQLite
     columns: Dict with columns to initiate in the table. {column1 name: column1 python type, ...}
     connection: sqlite3 Connection object to the database
+    indexed_columns: Columns to create single-column indexes on, when the table is created.
+    The first column is skipped, because the content index can be used for it. Each index slows down inserts.
+    query_advisor: Optional QueryAdvisor object that records filtered queries
     """
 
-    def __init__(self, name: str, columns: dict, connection: sqlite3.Connection) -> None:
+    def __init__(self, name: str, columns: dict, connection: sqlite3.Connection, create: bool = True,
+                 indexed_columns: list[str] = None, query_advisor: QueryAdvisor = None) -> None:
         self.name = name
         self.columns = {column_name: get_sql_type(column_type) for column_name, column_type in columns.items()}
         self.connection = connection
+        self.indexed_columns = indexed_columns or list()
+        self.query_advisor = query_advisor
 
-        create_table(
-            table=self.name,
-            columns=self.columns,
-            connection=self.connection)
+        if create:              # Can be skipped if the table is known to exist (e.g. created by ConnectionPool)
+            create_table(
+                table=self.name,
+                columns=self.columns,
+                connection=self.connection)
+            create_index(
+                table=self.name,
+                columns=list(self.columns),
+                connection=self.connection,
+                name=f"{self.name}_content")
+            self.check_columns(self.indexed_columns)
+            for column_name in self.indexed_columns:            # Secondary indexes for filtering
+                if column_name == next(iter(self.columns)):     # Leading column of the content index, already indexed
+                    continue
+                create_index(
+                    table=self.name,
+                    columns=[column_name],
+                    connection=self.connection)
+            create_table(
+                table=VERSION_TABLE,
+                columns={"table_name": "TEXT PRIMARY KEY", "version": "INTEGER"},
+                connection=self.connection)
+
+    def commit(self, n_changes: int) -> int:
+        """
+        Commit changes made to the table, together with the table version increase.
+        :param n_changes: Number of rows inserted or deleted in the transaction
+        :return: Table version after commit
+        """
+        version = bump_table_version(self.name, self.connection, n_changes) if n_changes else None
+        self.connection.commit()
+        return version if version is not None else get_table_version(self.name, self.connection)
+
+    def version(self) -> int:
+        """Current table version. See get_table_version"""
+        return get_table_version(self.name, self.connection)
+
+    def after_insert(self, rows: list[tuple], n_rows_inserted: int, version: int) -> None:
+        """Hook that is run after each committed chunk of inserts. For subclasses that keep derived data."""
+        return
+
+    def before_delete_commit(self, n_deleted_rows: int) -> None:
+        """Hook that is run in the delete transaction, before commit. For subclasses that keep derived data."""
+        return
 
     def insert(self, **kwargs) -> int:
         """Insert a row to the table. Returns the number of rows inserted (0 or 1)"""
@@ -345,101 +1120,419 @@ class SqlTableInterface:
             **kwargs)
         return n_rows_inserted
 
-    def select(self, where: (str | list[str]) = None) -> list[dict]:
+    def insert_many(self, column_names: list[str], rows: Iterable[tuple],
+                    chunk_size: int = DEFAULT_INSERT_CHUNK_SIZE, unique: bool = False, commit: bool = True) -> int:
+        """
+        Insert rows to the table in chunks. Each chunk is inserted and committed in a single transaction.
+        :param column_names: Names of the columns to insert to
+        :param rows: Iterable of value tuples, in the same order as column_names
+        :param chunk_size: Number of rows per transaction
+        :param unique: Only insert rows that don't exist yet. Uses the content index for lookups.
+        :param commit: Commit each chunk. If False, the caller is responsible for calling SqlTableInterface.commit
+        with the total number of inserted rows. after_insert hook isn't run for uncommitted chunks.
+        :return: Total number of rows inserted
+        """
+        n_rows_inserted = 0
+        rows = iter(rows)
+        while chunk := list(itertools.islice(rows, chunk_size)):
+            n_chunk_rows_inserted = insert_rows(
+                table=self.name,
+                connection=self.connection,
+                column_names=column_names,
+                rows=chunk,
+                unique=unique,
+                commit=False)
+            if n_chunk_rows_inserted and commit:
+                version = self.commit(n_chunk_rows_inserted)
+                self.after_insert(chunk, n_chunk_rows_inserted, version)
+            n_rows_inserted += n_chunk_rows_inserted
+        return n_rows_inserted
+
+    def parse_where(self, where: (str | list[str])) -> (tuple | None):
+        """
+        Parse "where"-statements to a compiled where string with placeholders and values.
+        Raises ValueError if the statements can't be parsed or refer to columns that are not in the table.
+        :param where: "where"-statements. A single string or a list of strings. E.g. "column1 != 'red'"
+        :return: A tuple (where string, values), or None if no statements are given
+        """
+        if not where:
+            return None
+        where = [where] if not isinstance(where, list) else where              # Make sure where variable is a list
+        return compile_where(tuple(where), tuple(self.columns))
+
+    @contextmanager
+    def advise(self, where: (str | list[str])) -> Iterator[None]:
+        """Context manager that times the enclosed query and records it in query advisor, if there is one."""
+        started = time.perf_counter()
+        yield
+        if self.query_advisor is not None and where and where is not True:
+            statements = [where] if not isinstance(where, list) else where
+            self.query_advisor.record(
+                table=self.name,
+                connection=self.connection,
+                statements=statements,
+                where=self.parse_where(statements),
+                duration=time.perf_counter() - started)
+
+    def check_columns(self, columns: list[str]) -> None:
+        """Raise ValueError if any of the input column names don't exist in the table."""
+        unknown_columns = [column for column in columns or list() if column not in self.columns]
+        if unknown_columns:
+            raise ValueError(
+                f"Unknown columns: {', '.join(unknown_columns)}. "
+                f"Available columns: {', '.join(self.columns)}")
+
+    def select(self, where: (str | list[str]) = None, columns: list[str] = None,
+               after: int = None, limit: int = None) -> list[dict]:
         """
         Get data from the table.
         Data is filtered if "where"-statements are given. Otherwise, all data from the table is returned.
         :param where: "where"-statements. A single string or a list of strings. E.g. "WHERE column1 != 'red'"
+        :param columns: Names of columns to select. All columns if not given
+        :param after: Only return rows with rowid greater than this value (keyset pagination)
+        :param limit: Maximum number of rows to return
         :return: Selected data
         """
-        if where:               # Parse where inputs
-            where = [where] if not isinstance(where, list) else where          # Make sure where variable is a list
-            where_parsed = [parse_where_parameter(parameter) for parameter in where]
-            where_statement, where_values = compile_where_statement(where_parsed)
-            where = (where_statement, where_values)
-        # Read
-        result = read_table(
+        self.check_columns(columns)
+        with self.advise(where):
+            result = read_table(
+                table=self.name,
+                connection=self.connection,
+                where=self.parse_where(where),
+                columns=columns,
+                after=after,
+                limit=limit)
+        return result
+
+    def select_cursor(self, where: (str | list[str]) = None, columns: list[str] = None,
+                      after: int = None, limit: int = None) -> sqlite3.Cursor:
+        """
+        Same as SqlTableInterface.select, but returns an executed cursor instead of fetching the rows.
+        Lets callers stream large results without loading them to memory.
+        Query advisor only sees the time to the first row.
+        :return: sqlite3 Cursor object. Column names are in cursor.description
+        """
+        self.check_columns(columns)
+        with self.advise(where):
+            cursor = query_table(
+                table=self.name,
+                connection=self.connection,
+                where=self.parse_where(where),
+                columns=columns,
+                after=after,
+                limit=limit)
+        return cursor
+
+    def page_end(self, where: (str | list[str]) = None, after: int = None, limit: int = None) -> (int | None):
+        """
+        Get the "after" value for the next page of a paginated select. None if there are no rows after the page.
+        Run it in the same read transaction as the select (see begin_read). See get_page_end for details.
+        """
+        page_end = get_page_end(
             table=self.name,
             connection=self.connection,
-            where=where)
-        return result
+            where=self.parse_where(where),
+            after=after,
+            limit=limit)
+        return page_end
 
-    def delete(self, where: (str | list[str]) = 0):
+    def delete(self, where: (str | list[str] | bool) = 0):
         """
         Delete data from the table.
         Selected rows are deleted if "where"-statements are given. No action if no "where"-statement is given.
         :param where: "where"-statements. A single string or a list of strings. E.g. "WHERE column1 != 'red'"
+        If True, all rows are deleted.
         :return: Number of rows deleted
         """
-        if where:               # Parse where inputs
-            where = [where] if not isinstance(where, list) else where           # Make sure where variable is a list
-            where_parsed = [parse_where_parameter(parameter) for parameter in where]
-            where_statement, where_values = compile_where_statement(where_parsed)
-            where = (where_statement, where_values)
-
-        n_deleted_rows = delete_rows(
-            table=self.name,
-            connection=self.connection,
-            where=where)
+        with self.advise(where):
+            n_deleted_rows = delete_rows(
+                table=self.name,
+                connection=self.connection,
+                where=self.parse_where(where) if where and where is not True else where,
+                commit=False)
+            self.before_delete_commit(n_deleted_rows)
+            self.commit(n_deleted_rows)
         return n_deleted_rows
 
+    def delete_chunked(self, where: (str | list[str] | bool) = 0, chunk_size: int = DEFAULT_DELETE_CHUNK_SIZE,
+                       stats: DeleteStats = None) -> int:
+        """
+        Delete data from the table in chunks of rows with consecutive rowids, each in its own short transaction,
+        so that other writers don't have to wait for the whole delete. Chunk bounds are found like page ends in
+        keyset pagination (see get_page_end).
+        Not atomic: readers can see a partly done delete, and chunks that are already committed stay deleted
+        if a later chunk fails. Matching rows inserted during the delete can be deleted as well.
+        :param where: "where"-statements. See SqlTableInterface.delete
+        :param chunk_size: Number of rows to delete per transaction
+        :param stats: DeleteStats object to update with progress after each chunk
+        :return: Number of rows deleted
+        """
+        if not where:                                           # No action, like in delete
+            return 0
+        stats = DeleteStats() if stats is None else stats
+        compiled_where = self.parse_where(where) if where is not True else None
+        started = time.perf_counter()
+        after = None
+        n_deleted_rows_total = 0
+        with self.advise(where):
+            while True:
+                until = get_page_end(self.name, self.connection, where=compiled_where, after=after, limit=chunk_size)
+                n_deleted_rows = delete_rows(
+                    table=self.name,
+                    connection=self.connection,
+                    where=compiled_where or True,
+                    commit=False,
+                    after=after,
+                    until=until)
+                self.before_delete_commit(n_deleted_rows)
+                self.commit(n_deleted_rows)
+                n_deleted_rows_total += n_deleted_rows
+                stats.n_rows_deleted += n_deleted_rows
+                stats.n_chunks += 1
+                stats.seconds = time.perf_counter() - started
+                if until is None:                               # Last chunk: at most chunk_size rows were left
+                    return n_deleted_rows_total
+                after = until
+
 
 class SqlIrisInterface(SqlTableInterface):
     """
     Interface class for SQLite operations on a table for data from Iris class.
     Connects to an existing table or creates it if it doesn't exist.
+    If a SummaryCache is given, it's used for summaries and kept up to date by inserts and deletes.
+    By default, all columns except the first one get a secondary index for filtering.
+    The first column (sepal_length) is the leading column of the content index, which is used for filtering on it.
+    Also keeps the state of synced urls (see save_sync_source), which is cleared when rows are deleted.
     """
     type_class = Iris
     name = type_class.__name__
     # Type names for class columns
     columns_python_types = {column_name: column_type.__name__ for
                             column_name, column_type in type_class.__annotations__.items()}
+    default_indexed_columns = list(columns_python_types)[1:]
 
-    def __init__(self, connection: sqlite3.Connection) -> None:
+    def __init__(self, connection: sqlite3.Connection, create: bool = True, indexed_columns: list[str] = None,
+                 summary_cache: SummaryCache = None, query_advisor: QueryAdvisor = None) -> None:
         SqlTableInterface.__init__(
             self,
             name=self.name,
             columns=self.columns_python_types,
-            connection=connection)
+            connection=connection,
+            create=create,
+            indexed_columns=self.default_indexed_columns if indexed_columns is None else indexed_columns,
+            query_advisor=query_advisor)
+        self.summary_cache = summary_cache
+        if create:
+            create_sync_source_table(self.connection)
 
-    def select_iris(self, where: (str | list[str]) = None) -> list[Iris]:
+    @classmethod
+    def bootstrap(cls, connection: sqlite3.Connection, indexed_columns: list[str] = None) -> None:
+        """
+        Create the Iris table and its indexes if they don't exist.
+        Meant to be run once per database, e.g. by ConnectionPool.
+        Existing indexes on columns that are not in indexed_columns are not dropped.
+        """
+        cls(connection=connection, indexed_columns=indexed_columns)
+
+    def select_iris(self, where: (str | list[str]) = None, after: int = None, limit: int = None) -> list[Iris]:
         """
         Get sql data with items formatted to the Iris class.
         Data is filtered if "where"-statements are given. Otherwise, all data from the table is returned.
         :param where: "where"-statements. A single string or a list of strings. E.g. "WHERE species != 'virginica'"
+        :param after: Only return rows with rowid greater than this value (keyset pagination)
+        :param limit: Maximum number of rows to return
         :return: A list of Iris objects corresponding to returned rows
         """
-        data_raw = self.select(where=where)
+        data_raw = self.select(where=where, after=after, limit=limit)
         data_iris = list()
         for row in data_raw:        # Typecast data to Iris class
             data_iris += [self.type_class(**row)]
         return data_iris
 
-    def insert_iris(self, data: list[Iris], unique: bool = False):
+    def insert_iris(self, data: (IrisBatch | list[Iris]), unique: bool = False,
+                    chunk_size: int = DEFAULT_INSERT_CHUNK_SIZE, commit: bool = True) -> int:
         """
-        Inserts Iris objects to SQLite.
-        Uses list input to avoid redundant comparisons for every insertion.
-        :param data: List of Iris object corresponding to rows to insert
+        Inserts Iris data to SQLite.
+        Rows are inserted in chunks, with one transaction per chunk.
+        :param data: IrisBatch or list of Iris objects corresponding to rows to insert
         :param unique: Only non-existing rows are inserted if True. Data is also deduplicated before inserting if True.
+        Existing rows are looked up from the content index, so the table is never loaded to memory.
+        :param chunk_size: Number of rows to insert per transaction
+        :param commit: Commit each chunk. If False, the caller commits (see SqlTableInterface.insert_many)
         :return: Total number of rows inserted.
         """
-        n_rows_inserted = 0
-        if unique:
-            existing_data = self.select_iris()
-            # deduplicate input data and insert rows that are not yet present.
-            for row in set(data):
-                if row not in existing_data:
-                    n_rows_inserted += self.insert(**row.as_dict())
-        else:
-            for row in data:
-                n_rows_inserted += self.insert(**row.as_dict())
+        n_rows_inserted = self.insert_many(
+            column_names=list(self.columns_python_types),
+            rows=self.iter_rows(data),
+            chunk_size=chunk_size,
+            unique=unique,
+            commit=commit)
         return n_rows_inserted
 
+    @staticmethod
+    def iter_rows(data: (IrisBatch | list[Iris])) -> Iterator[tuple]:
+        """Value tuples of Iris data, in the order of columns. IrisBatch gives them without creating Iris objects"""
+        return data.rows() if isinstance(data, IrisBatch) else (row.as_tuple() for row in data)
+
+    def after_insert(self, rows: list[tuple], n_rows_inserted: int, version: int) -> None:
+        """Add inserted rows to summary cache."""
+        if self.summary_cache is not None:
+            self.summary_cache.add(rows, n_rows_inserted, version)
+
+    def before_delete_commit(self, n_deleted_rows: int) -> None:
+        """Forget synced url state, so that deleted rows are restored by the next sync."""
+        if n_deleted_rows:
+            clear_sync_sources(self.connection, commit=False)
+
     def summary(self) -> dict[dict]:
         """Return a nested dict with summary info for each column in the SQLite table."""
-        data = self.select_iris()
-        if not data:          # Handle cases where table has no content - create an empty Iris object
-            sql_columns = get_columns(table=self.name, connection=self.connection)
-            data = [self.type_class(**{column: get_python_type(sql_type)() for column, sql_type in sql_columns.items()})]
-        summary = get_table_summary(data)
+        if self.summary_cache is not None:
+            return self.summary_cache.get(table=self.name, connection=self.connection)
+        summary = summarize_table(
+            table=self.name,
+            columns=self.columns_python_types,
+            connection=self.connection)
         return summary
+
+
+###############
+# Write queue #
+###############
+
+@dataclass
+class WriteRequest:
+    """Batch of Iris rows waiting to be inserted by WriteQueue"""
+    data: (IrisBatch | list[Iris])
+    unique: bool
+    future: Future                  # Resolved with the number of inserted rows, or the exception
+
+
+class WriteQueue:
+    """
+    In-process queue of inserts, written by a single writer thread.
+    Request threads (POST) and syncs submit batches and wait for their futures. The writer takes all queued batches
+    (up to max_transaction_rows rows) and inserts them in a single transaction (group commit),
+    so that concurrent requests don't compete for the write lock and share the cost of a commit.
+    Futures are resolved after the commit. If the transaction fails, it's rolled back and all of its futures get
+    the exception. Commits are durable as configured by the synchronous pragma (see DEFAULT_PRAGMAS).
+    Committed rows are added to the summary cache of the table (see SqlIrisInterface.after_insert).
+    Writer thread is started on the first submit and stopped by close.
+    Other writes (deletes, chunks of chunked deletes, sync state) are not queued - they are short transactions
+    of their own.
+
+    Instance attributes:
+    connection_pool: ConnectionPool to borrow the writer connection from
+    get_table: Function that returns an SqlIrisInterface object for a connection
+    max_transaction_rows: Maximum number of rows per transaction. A single larger batch gets its own transaction
+    chunk_size: Number of rows per executemany call. See SqlTableInterface.insert_many
+    max_queued_batches: Number of batches that can wait in the queue. Submit blocks while the queue is full
+    """
+
+    def __init__(self, connection_pool: ConnectionPool, get_table: Callable[[sqlite3.Connection], "SqlIrisInterface"],
+                 max_transaction_rows: int = DEFAULT_GROUP_COMMIT_ROWS, chunk_size: int = DEFAULT_INSERT_CHUNK_SIZE,
+                 max_queued_batches: int = DEFAULT_WRITE_QUEUE_SIZE) -> None:
+        self.connection_pool = connection_pool
+        self.get_table = get_table
+        self.max_transaction_rows = max_transaction_rows
+        self.chunk_size = chunk_size
+        self.max_queued_batches = max_queued_batches
+        self._queue = queue.Queue(maxsize=max_queued_batches)         # WriteRequest objects. None stops the writer
+        self._lock = threading.Lock()
+        # Held while a request or the stop marker is put to the queue, so that nothing is queued after the marker.
+        # Writer thread doesn't take it, so submits waiting for a full queue can't block the writer
+        self._put_lock = threading.Lock()
+        self._writer = None
+        self._closed = False
+        self._counts = Counter()                # Transactions, batches and rows written
+
+    def submit(self, data: (IrisBatch | list[Iris]), unique: bool = False) -> Future:
+        """
+        Queue rows for inserting.
+        :param data: IrisBatch or list of Iris objects
+        :param unique: Only insert rows that don't exist yet. See SqlIrisInterface.insert_iris
+        :return: Future that is resolved with the number of inserted rows when they are committed
+        """
+        request = WriteRequest(data=data, unique=unique, future=Future())
+        with self._put_lock:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("Write queue is closed.")
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._run, name="sql_writer", daemon=True)
+                    self._writer.start()
+            self._queue.put(request)
+        return request.future
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            request = self._queue.get()
+            if request is None:
+                break
+            group = [request]                   # Requests that arrived while the previous group was written
+            n_rows = len(request.data)
+            while n_rows < self.max_transaction_rows:
+                try:
+                    request = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                group += [request]
+                n_rows += len(request.data)
+            self._write(group)
+
+    def _write(self, group: list[WriteRequest]) -> None:
+        """Insert requests in a single transaction and resolve their futures."""
+        try:
+            with self.connection_pool.connection() as connection:
+                table = self.get_table(connection)
+                try:
+                    n_rows_inserted = [
+                        table.insert_iris(
+                            data=request.data,
+                            unique=request.unique,
+                            chunk_size=self.chunk_size,
+                            commit=False)
+                        for request in group]
+                    version = table.commit(sum(n_rows_inserted))
+                except BaseException:
+                    connection.rollback()
+                    raise
+                if sum(n_rows_inserted):
+                    rows = [row for request in group for row in table.iter_rows(request.data)]
+                    table.after_insert(rows, sum(n_rows_inserted), version)
+        except Exception as exception:
+            for request in group:
+                request.future.set_exception(exception)
+            return
+        with self._lock:
+            self._counts["transactions"] += 1
+            self._counts["batches"] += len(group)
+            self._counts["rows_inserted"] += sum(n_rows_inserted)
+            self._counts["max_batches_per_transaction"] = max(self._counts["max_batches_per_transaction"], len(group))
+        for request, n_request_rows_inserted in zip(group, n_rows_inserted):
+            request.future.set_result(n_request_rows_inserted)
+
+    def close(self, timeout: float = None) -> None:
+        """Stop accepting batches and wait until the queued batches are written."""
+        with self._put_lock:
+            with self._lock:
+                self._closed = True
+                writer = self._writer
+            if writer is not None:
+                self._queue.put(None)
+        if writer is not None:
+            writer.join(timeout)
+
+    def stats(self) -> dict:
+        """Number of transactions, batches and rows written, and batches waiting in the queue."""
+        with self._lock:
+            counts = Counter(self._counts)
+        return {
+            "transactions": counts["transactions"],
+            "batches": counts["batches"],
+            "rows_inserted": counts["rows_inserted"],
+            "max_batches_per_transaction": counts["max_batches_per_transaction"],
+            "queued_batches": self._queue.qsize()}
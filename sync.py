@@ -0,0 +1,255 @@
+# standard
+import codecs
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+import queue
+import threading
+import time
+from typing import Callable, Iterable, Iterator, TYPE_CHECKING
+import urllib.parse
+# local
+import iris
+
+# requests is imported when the first session is created (see create_session), not when the app starts
+if TYPE_CHECKING:
+    import requests
+
+# Seconds to wait for connecting to the source and for each read from it
+DEFAULT_TIMEOUT = (10, 60)
+# Bytes to read from the source at a time
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Number of parsed batches that each download can get ahead of the inserts
+PREFETCH_BATCHES = 2
+# Maximum number of simultaneous downloads per sync, and per host
+DEFAULT_MAX_DOWNLOADS = 4
+DEFAULT_MAX_DOWNLOADS_PER_HOST = 2
+
+
+###########
+# Classes #
+###########
+
+class HostLimiter:
+    """
+    Limits the number of simultaneous downloads from each host.
+    Meant to be shared by all syncs of the process, so that concurrent syncs don't overload a source.
+
+    Instance attributes:
+    max_per_host: Maximum number of simultaneous downloads per host
+    """
+
+    def __init__(self, max_per_host: int = DEFAULT_MAX_DOWNLOADS_PER_HOST) -> None:
+        self.max_per_host = max_per_host
+        self._lock = threading.Lock()
+        self._semaphores = dict()               # {host: BoundedSemaphore}
+
+    @contextmanager
+    def limit(self, url: str) -> Iterator[None]:
+        """Context manager that waits until a download from the host of the url is allowed."""
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        with self._lock:
+            semaphore = self._semaphores.setdefault(host, threading.BoundedSemaphore(self.max_per_host))
+        with semaphore:
+            yield
+
+
+@dataclass
+class SyncStats:
+    """
+    Progress counters and time spent in each stage of a sync from one url.
+    Download and parse counters are updated by the downloading thread, the rest by the inserting thread.
+    """
+    n_bytes_downloaded: int = 0
+    n_rows_parsed: int = 0
+    n_rows_inserted: int = 0
+    download_seconds: float = 0
+    parse_seconds: float = 0
+    insert_seconds: float = 0
+    total_seconds: float = 0
+    error: (str | None) = None
+
+    def server_timing(self) -> str:
+        """Timings in the format of Server-Timing http header, in milliseconds."""
+        timings = {
+            "download": self.download_seconds,
+            "parse": self.parse_seconds,
+            "insert": self.insert_seconds,
+            "total": self.total_seconds}
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+class Download:
+    """
+    Streamed download of text data.
+    Content is counted while it's read, so it's never held in memory as a whole.
+
+    Instance attributes:
+    response: requests Response object of a request made with stream=True
+    stats: SyncStats object to update with downloaded bytes and download time
+    etag: ETag header of the response
+    last_modified: Last-Modified header of the response
+    """
+
+    def __init__(self, response: "requests.Response", stats: SyncStats) -> None:
+        self.response = response
+        self.stats = stats
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        """Iterate over raw content chunks. Time spent waiting for the network is added to download time."""
+        chunks = self.response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+        while True:
+            started = time.perf_counter()
+            chunk = next(chunks, None)
+            self.stats.download_seconds += time.perf_counter() - started
+            if chunk is None:
+                return
+            self.stats.n_bytes_downloaded += len(chunk)
+            yield chunk
+
+    def iter_lines(self) -> Iterator[str]:
+        """
+        Iterate over decoded lines of content, with line endings kept (as expected by csv.reader).
+        Lines are split from raw chunks instead of Response.iter_lines, so that downloaded bytes and time are counted.
+        Content is decoded strictly, like posted data: invalid bytes raise UnicodeDecodeError.
+        """
+        return iris.split_lines(codecs.iterdecode(self.iter_chunks(), self.charset))
+
+    @property
+    def charset(self) -> str:
+        """
+        Charset from the Content-Type header, utf-8 if not given (like for posted data).
+        Response.encoding isn't used, because requests defaults to ISO-8859-1 for text content without a charset.
+        """
+        for parameter in self.response.headers.get("Content-Type", str()).split(";")[1:]:
+            name, _, value = parameter.partition("=")
+            if name.strip().lower() == "charset" and value.strip():
+                return value.strip().strip("\"'")
+        return "utf-8"
+
+
+#############
+# Functions #
+#############
+
+def create_session(max_connections: int = 8) -> "requests.Session":
+    """
+    Create a requests Session that keeps connections to sources open between syncs.
+    :param max_connections: Maximum number of connections to keep open per host
+    :return: requests Session object
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def request_if_changed(url: str, session: "requests.Session", sync_source: dict = None,
+                       timeout: tuple = DEFAULT_TIMEOUT) -> "requests.Response | None":
+    """
+    Start streaming download of data, unless it hasn't changed since the last sync.
+    Sends ETag and Last-Modified of the last sync as conditional request headers.
+    :param url: Data url
+    :param session: requests Session to use for the request
+    :param sync_source: State of the last sync from the url (see sql_operations.get_sync_source). None if not synced
+    :param timeout: Connect and read timeout in seconds
+    :return: requests Response with unread content (should be closed by the caller).
+    None if the source answered 304 Not Modified.
+    """
+    sync_source = sync_source or dict()
+    headers = dict()
+    if sync_source.get("etag"):
+        headers["If-None-Match"] = sync_source["etag"]
+    if sync_source.get("last_modified"):
+        headers["If-Modified-Since"] = sync_source["last_modified"]
+
+    response = session.get(url, headers=headers, timeout=timeout, stream=True)
+    if response.status_code == 304:
+        response.close()
+        return None
+    if not response:
+        response.close()
+        import requests
+        raise requests.HTTPError(f"{response.status_code} ({response.reason}). url: {url}.")
+    return response
+
+
+def iter_csv_download(download: Download, batch_size: int) -> Iterator[iris.IrisBatch]:
+    """
+    Parse Iris data from a streamed csv download, batch by batch.
+    Time spent parsing (excluding waiting for the network) is added to parse time.
+    :param download: Download object
+    :param batch_size: Number of rows per batch
+    :return: Iterator of IrisBatch objects
+    """
+    stats = download.stats
+    iris_batches = iris.iter_csv_batches(download.iter_lines(), batch_size=batch_size)
+    while True:
+        started = time.perf_counter()
+        download_seconds = stats.download_seconds
+        iris_batch = next(iris_batches, None)
+        stats.parse_seconds += time.perf_counter() - started - (stats.download_seconds - download_seconds)
+        if iris_batch is None:
+            return
+        stats.n_rows_parsed += len(iris_batch)
+        yield iris_batch
+
+
+def fetch_concurrently(producers: dict[str, Callable[[], Iterable]], host_limiter: HostLimiter,
+                       max_workers: int = DEFAULT_MAX_DOWNLOADS, max_buffered: int = PREFETCH_BATCHES) -> Iterator[tuple]:
+    """
+    Run producers for several urls (e.g. downloads that yield parsed batches) on a thread pool and merge their output,
+    so that a single consumer (e.g. the database writer) can process items as soon as any of the downloads has them.
+    Producers for the same host are limited by host_limiter. Producers wait, if the consumer falls behind.
+    If the consumer stops early, producers stop at their next item.
+    :param producers: {url: function that returns an iterable of items for the url}
+    :param host_limiter: HostLimiter object to limit the number of simultaneous producers per host
+    :param max_workers: Maximum number of simultaneous producers
+    :param max_buffered: Number of items that each producer thread can get ahead of the consumer
+    :return: Iterator of (url, item, None) tuples. When a url is finished, (url, None, None) or,
+    if the producer raised an exception, (url, None, exception).
+    """
+    max_workers = max(1, min(max_workers, len(producers)))
+    buffer = queue.Queue(maxsize=max_buffered * max_workers)
+    stopped = threading.Event()
+
+    def put(event: tuple) -> bool:
+        while not stopped.is_set():
+            try:
+                buffer.put(event, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(url: str, producer: Callable[[], Iterable]) -> None:
+        try:
+            with host_limiter.limit(url):
+                if stopped.is_set():
+                    return
+                for item in producer():
+                    if not put((url, item, None)):
+                        return
+        except Exception as exception:
+            put((url, None, exception))
+            return
+        put((url, None, None))
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sync")
+    for url, producer in producers.items():
+        executor.submit(produce, url, producer)
+    try:
+        n_remaining_urls = len(producers)
+        while n_remaining_urls:
+            url, item, exception = buffer.get()
+            if item is None:
+                n_remaining_urls -= 1
+            yield url, item, exception
+    finally:
+        stopped.set()
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,330 @@
+# standard
+from array import array
+import functools
+import gc
+import http.server
+import io
+import pathlib
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import weakref
+# external
+import flask
+# local
+import app
+import iris
+from settings import Settings
+import sql_operations
+
+iris_csv = """\
+sepal_length,sepal_width,petal_length,petal_width,species
+111,222,333,444,Iris species name
+1,2,3,4,Iris species name
+"""
+
+
+def get_test_client(tmp_path, **settings):
+    """Test client of an app with a database in a temporary directory."""
+    test_app = app.create_app(Settings(sql_path=str(tmp_path / "iris.sql"), **settings))
+    return test_app.test_client()
+
+
+def serve(handler) -> http.server.ThreadingHTTPServer:
+    """Serve requests with a handler class on a free local port, in a background thread."""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_slow_csv_handler(first_part: str, second_part: str, release: threading.Event) -> type:
+    """Handler class that sends csv in two parts (chunked encoding) and waits for release before the second one."""
+
+    class SlowCsvHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for part in (first_part.encode(), second_part.encode(), bytes()):    # Empty chunk ends the content
+                self.wfile.write(f"{len(part):x}\r\n".encode() + part + b"\r\n")
+                self.wfile.flush()
+                if part == first_part.encode():
+                    release.wait(timeout=5)
+
+        def log_message(self, *args):
+            return
+
+    return SlowCsvHandler
+
+
+def test_settings_from_env():
+    environ = {
+        "SQL_PATH": "/data/iris.sql",
+        "SQL_INDEXED_COLUMNS": "species, petal_width",
+        "QUERY_ADVISOR": "1",
+        "DEFAULT_IRIS_DATA_URL": "https://example.com/iris.csv",
+        "LOG_LEVEL": "debug",
+        "SQL_BUSY_TIMEOUT": ""}
+    settings = Settings.from_env(environ, job_workers=3)
+    assert settings.sql_path == "/data/iris.sql"
+    assert settings.sql_indexed_columns == ("species", "petal_width")
+    assert settings.query_advisor is True
+    assert settings.iris_data_urls == ("https://example.com/iris.csv",)
+    assert settings.log_level == "DEBUG"
+    assert settings.sql_busy_timeout is None
+    assert settings.job_workers == 3
+    assert Settings.from_env({"API_WORKERS": "8"}).api_workers == 8
+    assert Settings.from_env({}) == Settings()
+    assert Settings.from_env({"QUERY_ADVISOR": "Off"}).query_advisor is False
+
+
+def test_sync_bad_background_parameter(tmp_path):
+    client = get_test_client(tmp_path)
+    response = client.get("/api/v1/iris/sync?url=http://localhost/iris.csv&background=maybe")
+    assert response.status_code == 400
+    assert "ValueError" in response.get_data(as_text=True)
+
+
+def test_post_and_get(tmp_path):
+    client = get_test_client(tmp_path)
+    response = client.post("/api/v1/iris", data=iris_csv, content_type="text/csv")
+    assert response.get_data(as_text=True) == "Inserted 2 rows."
+    response = client.get("/api/v1/iris?where=sepal_length>10")
+    assert response.get_json() == [{
+        "sepal_length": 111, "sepal_width": 222, "petal_length": 333, "petal_width": 444,
+        "species": "Iris species name"}]
+    assert client.get("/api/v1/stats").get_json()["startup"]["startup_seconds"] > 0
+    response = client.get("/api/v1/iris?limit=1")
+    assert client.get(f"/api/v1/iris?limit=1&after={response.headers['X-Next-Cursor']}").get_json() == [{
+        "sepal_length": 1, "sepal_width": 2, "petal_length": 3, "petal_width": 4, "species": "Iris species name"}]
+    assert "X-Next-Cursor" not in client.get("/api/v1/iris?limit=2").headers        # No empty last page
+
+
+def test_post_updates_summary_incrementally(tmp_path, monkeypatch):
+    count_values = sql_operations.count_values
+    n_summary_reloads = list()
+    monkeypatch.setattr(
+        sql_operations, "count_values", lambda *args: n_summary_reloads.append(1) or count_values(*args))
+    client = get_test_client(tmp_path)
+    client.get("/api/v1/iris/summary")
+    for _ in range(3):
+        client.post("/api/v1/iris", data=iris_csv, content_type="text/csv")
+        summary = client.get("/api/v1/iris/summary").get_json()
+    assert summary["species"]["n_total_values"] == 6
+    assert len(n_summary_reloads) == 1
+    client.post("/api/v1/iris/unique", data=iris_csv, content_type="text/csv")      # Nothing inserted
+    assert client.get("/api/v1/iris/summary").get_json() == summary
+    assert len(n_summary_reloads) == 1
+    client.post("/api/v1/iris/unique", data=iris_csv + "5,6,7,8,new\n", content_type="text/csv")
+    assert client.get("/api/v1/iris/summary").get_json()["species"]["n_total_values"] == 7
+    assert len(n_summary_reloads) == 2                      # Can't tell which rows were inserted - reloaded
+
+
+def test_post_json_array_value(tmp_path):
+    client = get_test_client(tmp_path)
+    response = client.post("/api/v1/iris", json=[{"sepal_length": [1]}])
+    assert response.status_code == 400
+    assert "ValueError" in response.get_data(as_text=True)
+
+
+def test_post_json_object_value(tmp_path):
+    client = get_test_client(tmp_path)
+    response = client.post("/api/v1/iris", json=[{"species": {"a": 1}}])
+    assert response.status_code == 400
+    assert client.get("/api/v1/iris/all").get_json() == []
+
+
+def test_apps_are_separate(tmp_path):
+    (tmp_path / "1").mkdir()
+    (tmp_path / "2").mkdir()
+    client1 = get_test_client(tmp_path / "1")
+    client2 = get_test_client(tmp_path / "2")
+    client1.post("/api/v1/iris", data=iris_csv, content_type="text/csv")
+    assert len(client1.get("/api/v1/iris/all").get_json()) == 2
+    assert client2.get("/api/v1/iris/all").get_json() == []
+
+
+def test_app_not_kept_alive():
+    test_app = app.create_app(Settings(sql_path=":memory:"))
+    iris_api = weakref.ref(test_app.extensions["iris_api"])
+    del test_app
+    gc.collect()
+    assert iris_api() is None
+
+
+def test_requests_not_imported_on_startup():
+    code = "import sys, app; app.create_app(app.Settings(sql_path=':memory:')); print('requests' in sys.modules)"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True,
+        cwd=pathlib.Path(__file__).parent.parent)
+    assert result.stdout.strip() == "False"
+
+
+def test_get_cached_with_etag(tmp_path):
+    client = get_test_client(tmp_path)
+    client.post("/api/v1/iris", data=iris_csv, content_type="text/csv")
+    response1 = client.get("/api/v1/iris?where=species=Iris species name&where=sepal_length>10")
+    response2 = client.get("/api/v1/iris?where=sepal_length > 10&where=species=Iris species name")
+    assert response1.get_data() == response2.get_data()
+    assert response1.headers["ETag"] == response2.headers["ETag"]
+    response = client.get("/api/v1/iris/all", headers={"If-None-Match": response1.headers["ETag"]})
+    assert response.status_code == 200
+    response = client.get(
+        "/api/v1/iris?where=sepal_length>10&where=species=Iris species name",
+        headers={"If-None-Match": response1.headers["ETag"]})
+    assert response.status_code == 304
+    client.delete("/api/v1/iris?where=sepal_length>10")                       # New table version
+    response = client.get(
+        "/api/v1/iris?where=sepal_length>10&where=species=Iris species name",
+        headers={"If-None-Match": response1.headers["ETag"]})
+    assert response.status_code == 200
+    assert response.get_json() == []
+    result_cache_stats = client.get("/api/v1/stats").get_json()["result_cache"]
+    assert (result_cache_stats["hits"], result_cache_stats["invalidated"]) == (2, 1)
+
+
+def test_get_same_as_jsonify(tmp_path):
+    test_app = app.create_app(Settings(sql_path=str(tmp_path / "iris.sql")))
+    client = test_app.test_client()
+    client.post("/api/v1/iris", data=iris_csv, content_type="text/csv")
+    with sqlite3.connect(tmp_path / "iris.sql") as connection:          # Values that Iris typecasts
+        connection.execute("INSERT INTO iris (sepal_length, species) VALUES (7, 'virginica ü');")
+    with test_app.app_context():
+        iris_api = app.get_iris_api()
+        with iris_api.connection_pool.connection() as sql_connection:
+            rows = iris_api.get_iris_table(sql_connection).select_iris()
+        expected = flask.jsonify([row.as_dict() for row in rows]).get_data()
+        expected_fields = flask.jsonify([{"species": row.species} for row in rows]).get_data()
+    assert client.get("/api/v1/iris/all").get_data() == expected
+    assert client.get("/api/v1/iris/all?stream=1").get_data() == expected
+    assert client.get("/api/v1/iris/all?stream=yes").get_data() == expected
+    assert client.get("/api/v1/iris/all?fields=species").get_data() == expected_fields
+    assert client.get("/api/v1/iris/all?fields=species,species&fields=species").get_data() == expected_fields
+
+
+def test_get_formats(tmp_path):
+    client = get_test_client(tmp_path)
+    client.post("/api/v1/iris", data=iris_csv, content_type="text/csv")
+    response = client.get("/api/v1/iris/all?format=csv")
+    assert response.mimetype == "text/csv"
+    assert response.get_data(as_text=True) == iris_csv.replace("111,222,333,444", "111.0,222.0,333.0,444.0") \
+        .replace("1,2,3,4", "1.0,2.0,3.0,4.0")
+    response = client.get("/api/v1/iris?where=sepal_length<10", headers={"Accept": "application/x-ndjson"})
+    assert response.get_data(as_text=True) == \
+        '{"petal_length":3.0,"petal_width":4.0,"sepal_length":1.0,"sepal_width":2.0,"species":"Iris species name"}\n'
+    response = client.get("/api/v1/iris/all?fields=species,petal_width", headers={"Accept": app.BINARY_MIMETYPE})
+    assert response.mimetype == app.BINARY_MIMETYPE
+    batches = list(iris.iter_binary_batches(io.BytesIO(response.get_data()).read))
+    assert batches == [{"species": ["Iris species name"] * 2, "petal_width": array("d", [444, 4])}]
+    assert client.get("/api/v1/iris/all?format=xml").status_code == 400
+
+
+def test_delete_chunked(tmp_path):
+    client = get_test_client(tmp_path)
+    client.post("/api/v1/iris", data=iris_csv, content_type="text/csv")
+    client.post("/api/v1/iris", data=iris_csv, content_type="text/csv")
+    response = client.delete("/api/v1/iris?where=sepal_length<10&chunked=1&chunk_size=1")
+    assert response.get_data(as_text=True) == "Deleted 2 rows"
+    response = client.delete("/api/v1/iris/all?background=1")
+    assert response.status_code == 202
+    job_id = response.get_json()["id"]
+    with client.application.app_context():
+        assert app.get_iris_api().job_manager.get(job_id).wait(timeout=5)
+    job_status = client.get(response.headers["Location"]).get_json()
+    assert job_status["state"] == "done"
+    assert job_status["progress"]["n_rows_deleted"] == 2
+    assert client.get("/api/v1/iris/all").get_json() == []
+    assert client.delete("/api/v1/iris?where=color=red&background=1").status_code == 400
+    assert client.delete("/api/v1/iris?where=species=a&background=maybe").status_code == 400
+    assert client.delete("/api/v1/iris?where=species=a&chunked=true").get_data(as_text=True) == "Deleted 0 rows"
+
+
+def test_sync_url(tmp_path):
+    (tmp_path / "iris.csv").write_text(iris_csv)
+    server = serve(functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(tmp_path)))
+    url = f"http://127.0.0.1:{server.server_address[1]}/iris.csv"
+    try:
+        client = get_test_client(tmp_path, sql_max_connections=1)     # Writer and sync don't hold two connections
+        response = client.get(f"/api/v1/iris/sync?url={url}")
+        assert response.get_data(as_text=True) == "Inserted 2 rows."
+        assert client.get("/api/v1/stats").get_json()["write_queue"]["rows_inserted"] == 2
+        assert "download;dur=" in response.headers["Server-Timing"]
+        assert client.get(f"/api/v1/iris/sync?url={url}").get_data(as_text=True) == "Inserted 0 rows."   # 304
+        assert len(client.get("/api/v1/iris/all").get_json()) == 2
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_sync_invalid_utf8(tmp_path):
+    (tmp_path / "iris.csv").write_bytes(iris_csv.encode() + b"1,2,3,4,\xff\n")
+    server = serve(functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(tmp_path)))
+    url = f"http://127.0.0.1:{server.server_address[1]}/iris.csv"
+    try:
+        client = get_test_client(tmp_path)
+        response = client.get(f"/api/v1/iris/sync?url={url}")
+        assert response.status_code == 400
+        assert "UnicodeDecodeError" in response.get_data(as_text=True)
+        with client.application.app_context(), app.get_iris_api().connection_pool.connection() as sql_connection:
+            assert sql_operations.get_sync_source(url, sql_connection) is None       # Downloaded again next time
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_sync_several_urls(tmp_path):
+    (tmp_path / "iris1.csv").write_text(iris_csv)
+    (tmp_path / "iris2.csv").write_text(iris_csv.replace("111,", "555,"))
+    server = serve(functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(tmp_path)))
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        client = get_test_client(tmp_path)
+        response = client.get(
+            f"/api/v1/iris/sync?url={base_url}/iris1.csv&url={base_url}/iris2.csv&url={base_url}/missing.csv")
+        result = response.get_json()
+        assert result["n_rows_inserted"] == 3                       # Second row is the same in both files
+        assert result["sources"][f"{base_url}/iris1.csv"]["error"] is None
+        assert "HTTPError" in result["sources"][f"{base_url}/missing.csv"]["error"]
+        with sqlite3.connect(tmp_path / "iris.sql") as connection:
+            synced_urls = {row[0] for row in connection.execute("SELECT url FROM SyncSource;")}
+        assert synced_urls == {f"{base_url}/iris1.csv", f"{base_url}/iris2.csv"}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_sync_background_slow_source(tmp_path):
+    rows = iris_csv.splitlines(keepends=True)
+    release = threading.Event()
+    server = serve(get_slow_csv_handler("".join(rows[:2]), rows[2], release))
+    url = f"http://127.0.0.1:{server.server_address[1]}/iris.csv"
+    try:
+        client = get_test_client(tmp_path, sql_busy_timeout=100, sql_insert_chunk_size=1)
+        response = client.get(f"/api/v1/iris/sync?url={url}&background=true")
+        assert response.status_code == 202
+        with client.application.app_context():
+            job = app.get_iris_api().job_manager.get(response.get_json()["id"])
+        for _ in range(500):                                        # Wait until the first row is inserted
+            if job.progress[url].n_rows_inserted:
+                break
+            time.sleep(0.01)
+        # Sync is waiting for the source, but doesn't hold the write lock
+        posted_csv = iris_csv.replace("Iris species name", "posted")
+        assert client.post("/api/v1/iris", data=posted_csv, content_type="text/csv").status_code == 200
+        assert client.delete("/api/v1/iris?where=species=posted").get_data(as_text=True) == "Deleted 2 rows"
+        release.set()
+        assert job.wait(timeout=5)
+        job_status = client.get(response.headers["Location"]).get_json()
+        assert job_status["state"] == "done"
+        assert job_status["progress"][url]["n_rows_inserted"] == 2
+        with client.application.app_context(), app.get_iris_api().connection_pool.connection() as sql_connection:
+            assert sql_operations.get_sync_source(url, sql_connection) is None       # Rows were deleted during sync
+    finally:
+        release.set()
+        server.shutdown()
+        server.server_close()
@@ -1,3 +1,7 @@
+# standard
+from array import array
+import io
+import json
 
 # local
 import iris
@@ -167,6 +171,14 @@ def test_load_from_csv_forbidden(caplog):
     assert "forbidden" in caplog.text
 
 
+def test_load_from_csv_forbidden_aggregated(caplog):
+    iris_batch = iris.from_csv(forbidden_iris_csv + ",extra value")
+    assert iris_batch.to_dicts() == [full_iris_dict, full_iris_dict2]
+    assert len(caplog.records) == 1
+    assert "forbidden_column (2 rows)" in caplog.text
+    assert f"{iris.UNNAMED_CSV_COLUMN} (1 rows)" in caplog.text
+
+
 def test_load_from_json():
     iris_list = iris.from_json([full_iris_dict, full_iris_dict2])
     assert iris_list[0].as_dict() == full_iris_dict
@@ -184,3 +196,134 @@ def test_load_from_json_forbidden(caplog):
     iris_list = iris.from_json([full_iris_dict, forbidden_iris_dict])
     assert "forbidden" in caplog.text
     assert len(iris_list) == 2
+
+
+def test_load_from_json_forbidden_aggregated(caplog):
+    payload = json.dumps([forbidden_iris_dict] * 3)
+    iris_batches = list(iris.iter_json_batches(iter([payload]), batch_size=2))
+    assert len(iris_batches) == 2
+    assert len(caplog.records) == 1
+    assert "forbidden_attribute (3 rows)" in caplog.text
+
+
+def test_load_from_json_not_object():
+    try:
+        iris.from_json([full_iris_dict, [1, 2]])
+    except ValueError as error:
+        assert "Expected an object" in str(error)
+    else:
+        assert False, "ValueError not raised"
+
+
+def test_load_from_json_array_value():
+    try:
+        iris.from_json([{"sepal_length": [1]}])
+    except ValueError as error:
+        assert "got list" in str(error)
+    else:
+        assert False, "ValueError not raised"
+
+
+def test_load_from_json_object_value():
+    try:
+        iris.from_json([{"species": {"a": 1}}])
+    except ValueError as error:
+        assert "got dict" in str(error)
+    else:
+        assert False, "ValueError not raised"
+
+
+def test_no_instance_dict():
+    assert not hasattr(full_iris, "__dict__")
+
+
+def test_hash():
+    iris1 = iris.Iris(**full_iris_dict)
+    iris2 = iris.Iris(**full_iris_dict)
+    assert hash(iris1) == hash(iris2)
+    assert len({iris1, iris2, iris.Iris(**full_iris_dict2)}) == 2
+
+
+def test_tuple_representation():
+    assert full_iris.as_tuple() == (111, 222, 333, 444, "Iris species name")
+
+
+def test_batch_columns():
+    iris_batch = iris.from_csv(full_iris_csv)
+    assert list(iris_batch.column("sepal_length")) == [111, 1111]
+    assert iris_batch.column("species") == ["Iris species name", "Iris species name2"]
+
+
+def test_batch_rows():
+    iris_batch = iris.IrisBatch.from_rows([full_iris.as_tuple()] * 3)
+    assert len(iris_batch) == 3
+    assert list(iris_batch.rows()) == [full_iris.as_tuple()] * 3
+    assert list(iris_batch) == [full_iris] * 3
+
+
+def test_batch_slice():
+    iris_batch = iris.from_json([full_iris_dict, full_iris_dict2, full_iris_dict])
+    assert iris_batch[1:].to_dicts() == [full_iris_dict2, full_iris_dict]
+    assert iris_batch[::-1].to_dicts() == [full_iris_dict, full_iris_dict2, full_iris_dict]
+    assert iris_batch[-1:0:-2].to_dicts() == [full_iris_dict]
+    assert iris_batch[5:].to_dicts() == []
+
+
+def test_batch_to_csv():
+    iris_batch = iris.from_csv(full_iris_csv)
+    assert iris.from_csv(iris_batch.to_csv()).to_dicts() == iris_batch.to_dicts()
+
+
+def test_load_from_csv_batches():
+    lines = iter(full_iris_csv.splitlines(keepends=True))
+    iris_batches = list(iris.iter_csv_batches(lines, batch_size=1))
+    assert [len(iris_batch) for iris_batch in iris_batches] == [1, 1]
+    assert iris_batches[1][0].as_dict() == full_iris_dict2
+
+
+def test_load_from_json_batches():
+    payload = json.dumps([full_iris_dict, full_iris_dict2, full_iris_dict])
+    chunks = (payload[i:i + 7] for i in range(0, len(payload), 7))
+    iris_batches = list(iris.iter_json_batches(chunks, batch_size=2))
+    assert [len(iris_batch) for iris_batch in iris_batches] == [2, 1]
+    assert iris_batches[0].to_dicts() == [full_iris_dict, full_iris_dict2]
+
+
+def test_load_from_json_batches_malformed():
+    try:
+        list(iris.iter_json_batches(iter([json.dumps([full_iris_dict])[:-1]]), batch_size=2))
+    except ValueError:
+        pass
+    else:
+        assert False, "ValueError not raised"
+
+
+def test_load_from_ndjson_batches():
+    lines = iter([json.dumps(full_iris_dict) + "\n", "\n", json.dumps(full_iris_dict2) + "\n"])
+    iris_batches = list(iris.iter_ndjson_batches(lines, batch_size=5))
+    assert iris_batches[0].to_dicts() == [full_iris_dict, full_iris_dict2]
+
+
+def test_json_row_encoder():
+    columns = ["species", "sepal_length", "petal_width"]
+    rows = [("setosa", 5.1, 0.2), ("virginica ü \"x\"", 7, None), (None, float("inf"), 1e-7)]
+    encode_row = iris.get_json_row_encoder(columns)
+    for row in rows:
+        expected = json.dumps(
+            {column: value for column, value in iris.Iris(**dict(zip(columns, row))).as_dict().items()
+             if column in columns},
+            sort_keys=True, separators=(",", ":"))
+        assert encode_row(row) == expected
+
+
+def test_binary_columns():
+    encoder = iris.BinaryColumnsEncoder(["species", "sepal_length"])
+    data = encoder.header() \
+        + encoder.encode_batch([("setosa", 1.5), ("virginica", None), ("setosa", 2)]) \
+        + encoder.encode_batch([("versicolor", 3.0)]) \
+        + encoder.end()
+    batches = list(iris.iter_binary_batches(io.BytesIO(data).read))
+    assert batches[0] == {"species": ["setosa", "virginica", "setosa"], "sepal_length": array("d", [1.5, 0, 2])}
+    assert batches[1] == {"species": ["versicolor"], "sepal_length": array("d", [3])}
+    # Header: 4 + 2 + (2 + 7) + (2 + 12), batch 1: 4 + (4 + 10 + 13 + 3 * 4) + 3 * 8, batch 2: 4 + (4 + 14 + 4) + 8, end: 4
+    assert len(data) == 29 + 67 + 34 + 4
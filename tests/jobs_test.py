@@ -0,0 +1,50 @@
+# standard
+import threading
+# local
+import jobs
+
+
+def test_job_runs():
+    job_manager = jobs.JobManager(max_workers=1)
+    progress = {"n_items": 0}
+
+    def count():
+        progress["n_items"] += 1
+
+    job = job_manager.submit("count", count, progress=progress)
+    assert job.wait(timeout=5)
+    assert job.state == "done"
+    assert job.as_dict()["progress"] == {"n_items": 1}
+    assert job_manager.get(job.id) is job
+
+
+def test_job_coalesced():
+    job_manager = jobs.JobManager(max_workers=2)
+    release = threading.Event()
+    job1 = job_manager.submit("wait", release.wait)
+    job2 = job_manager.submit("wait", release.wait)
+    job3 = job_manager.submit("other", release.wait)
+    assert job1 is job2
+    assert job1 is not job3
+    release.set()
+    assert job1.wait(timeout=5) and job3.wait(timeout=5)
+    assert job1.state == job3.state == "done"
+
+
+def test_job_failed():
+    job_manager = jobs.JobManager(max_workers=1)
+
+    def fail():
+        raise ValueError("bad job")
+
+    job = job_manager.submit("fail", fail)
+    assert job.wait(timeout=5)
+    assert job.state == "failed"
+    assert job.error == "ValueError: bad job"
+
+
+def test_finished_jobs_dropped():
+    job_manager = jobs.JobManager(max_workers=1, max_finished_jobs=2)
+    finished_jobs = [job_manager.submit(f"job {i}", lambda: None) for i in range(4)]
+    assert all(job.wait(timeout=5) for job in finished_jobs)
+    assert [job_manager.get(job.id) for job in finished_jobs] == [None, None] + finished_jobs[2:]
@@ -0,0 +1,29 @@
+# standard
+import logging
+import queue
+# local
+import log
+
+
+def test_queue_handler_drops_records():
+    handler = log.DroppingQueueHandler(queue.Queue(maxsize=2))
+    logger = logging.getLogger("log_test_drops")
+    logger.propagate = False
+    logger.addHandler(handler)
+    for i in range(5):
+        logger.warning("message %s", i)
+    logger.error("error message")
+    assert handler.queue.get_nowait().getMessage() == "message 0"
+    assert log.get_log_stats(logger) == {
+        "queued_records": 1,
+        "max_queued_records": 2,
+        "dropped_records": {"WARNING": 3, "ERROR": 1}}
+
+
+def test_setup_logger_writes_in_background(capsys):
+    logger = log.setup_logger("log_test_background", "INFO", indicator="indicator")
+    logger.propagate = False
+    logger.info("queued message")
+    queue_handler = logger.handlers[0]
+    queue_handler.queue.join()                      # Wait until the listener has written the record
+    assert "indicator" in capsys.readouterr().err
@@ -0,0 +1,427 @@
+# standard
+import sqlite3
+import threading
+import time
+# local
+import iris
+import sql_operations
+
+full_iris_dict = {
+    "sepal_length": 111,
+    "sepal_width": 222,
+    "petal_length": 333,
+    "petal_width": 444,
+    "species": "Iris species name"}
+
+full_iris_dict2 = {
+    "sepal_length": 1111,
+    "sepal_width": 2222,
+    "petal_length": 3333,
+    "petal_width": 4444,
+    "species": "Iris species name2"}
+
+
+def get_test_pool(tmp_path, **kwargs) -> sql_operations.ConnectionPool:
+    return sql_operations.ConnectionPool(
+        path=str(tmp_path / "iris.sql"),
+        bootstrap=sql_operations.SqlIrisInterface.bootstrap,
+        **kwargs)
+
+
+def test_pool_bootstraps_once(tmp_path):
+    bootstrap_calls = list()
+    pool = sql_operations.ConnectionPool(
+        path=str(tmp_path / "iris.sql"),
+        bootstrap=lambda connection: bootstrap_calls.append(connection))
+    with pool.connection():
+        pass
+    with pool.connection():
+        pass
+    assert len(bootstrap_calls) == 1
+
+
+def test_pool_creates_table(tmp_path):
+    pool = get_test_pool(tmp_path)
+    with pool.connection() as connection:
+        assert sql_operations.table_exists("Iris", connection)
+
+
+def test_pool_reuses_connections(tmp_path):
+    pool = get_test_pool(tmp_path)
+    with pool.connection() as connection1:
+        pass
+    with pool.connection() as connection2:
+        pass
+    assert connection1 is connection2
+
+
+def test_pool_applies_pragmas(tmp_path):
+    pool = get_test_pool(tmp_path, pragmas={"busy_timeout": 1234})
+    with pool.connection() as connection:
+        assert connection.execute("PRAGMA busy_timeout;").fetchone()[0] == 1234
+
+
+def test_pool_rolls_back_uncommitted(tmp_path):
+    pool = get_test_pool(tmp_path, max_connections=1)
+    with pool.connection() as connection:
+        connection.execute("INSERT INTO Iris (species) VALUES ('uncommitted');")
+    with pool.connection() as connection:
+        iris_table = sql_operations.SqlIrisInterface(connection=connection, create=False)
+        assert iris_table.select_iris() == list()
+
+
+def test_pool_shared_between_threads(tmp_path):
+    pool = get_test_pool(tmp_path, max_connections=2)
+
+    def insert():
+        with pool.connection() as connection:
+            iris_table = sql_operations.SqlIrisInterface(connection=connection, create=False)
+            iris_table.insert_iris([iris.Iris(**full_iris_dict)])
+
+    threads = [threading.Thread(target=insert) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with pool.connection() as connection:
+        iris_table = sql_operations.SqlIrisInterface(connection=connection, create=False)
+        assert len(iris_table.select_iris()) == 4
+
+
+def test_insert_iris_chunked(tmp_path):
+    pool = get_test_pool(tmp_path)
+    data = [iris.Iris(**full_iris_dict), iris.Iris(**full_iris_dict2)] * 5
+    with pool.connection() as connection:
+        iris_table = sql_operations.SqlIrisInterface(connection=connection, create=False)
+        n_rows_inserted = iris_table.insert_iris(data, chunk_size=3)
+        assert n_rows_inserted == 10
+        assert not connection.in_transaction
+        assert iris_table.select_iris() == data
+
+
+def test_insert_iris_empty(tmp_path):
+    pool = get_test_pool(tmp_path)
+    with pool.connection() as connection:
+        iris_table = sql_operations.SqlIrisInterface(connection=connection, create=False)
+        assert iris_table.insert_iris(list()) == 0
+
+
+def test_insert_iris_unique(tmp_path):
+    pool = get_test_pool(tmp_path)
+    with pool.connection() as connection:
+        iris_table = sql_operations.SqlIrisInterface(connection=connection, create=False)
+        iris_table.insert_iris([iris.Iris(**full_iris_dict)])
+        data = [iris.Iris(**full_iris_dict), iris.Iris(**full_iris_dict2), iris.Iris(**full_iris_dict2)]
+        assert iris_table.insert_iris(data, unique=True, chunk_size=1) == 1
+        assert iris_table.select_iris() == data[:2]
+
+
+def test_content_index_migration(tmp_path):
+    path = str(tmp_path / "iris.sql")
+    connection = sql_operations.get_connection(path)
+    columns = sql_operations.SqlIrisInterface.columns_python_types
+    sql_columns = {column: sql_operations.get_sql_type(column_type) for column, column_type in columns.items()}
+    sql_operations.create_table("Iris", sql_columns, connection)        # Database created without index
+    sql_operations.SqlIrisInterface.bootstrap(connection)
+    query_plan = connection.execute(
+        "EXPLAIN QUERY PLAN SELECT 1 FROM Iris WHERE sepal_length IS 1 AND species IS 'a';").fetchall()
+    assert "Iris_content" in str(query_plan)
+
+
+def test_select_pages(tmp_path):
+    pool = get_test_pool(tmp_path)
+    data = [iris.Iris(**full_iris_dict), iris.Iris(**full_iris_dict2)] * 3
+    with pool.connection() as connection:
+        iris_table = sql_operations.SqlIrisInterface(connection=connection, create=False)
+        iris_table.insert_iris(data)
+        pages = list()
+        after = None
+        while True:
+            pages += [iris_table.select_iris(after=after, limit=4)]
+            after = iris_table.page_end(after=after, limit=4)
+            if after is None:
+                break
+        assert [len(page) for page in pages] == [4, 2]
+        assert pages[0] + pages[1] == data
+
+
+def test_page_end_last_full_page(tmp_path):
+    pool = get_test_pool(tmp_path)
+    with pool.connection() as connection:
+        iris_table = sql_operations.SqlIrisInterface(connection=connection, create=False)
+        iris_table.insert_iris([iris.Iris(**full_iris_dict), iris.Iris(**full_iris_dict2)] * 2)
+        assert iris_table.page_end(limit=4) is None                 # Exactly limit rows left: no empty next page
+        assert iris_table.page_end(limit=3) is not None
+
+
+def test_page_end_same_snapshot(tmp_path):
+    pool = get_test_pool(tmp_path, max_connections=2)
+    with pool.connection() as connection, pool.connection() as other_connection:
+        iris_table = sql_operations.SqlIrisInterface(connection=connection, create=False)
+        other_table = sql_operations.SqlIrisInterface(connection=other_connection, create=False)
+        iris_table.insert_iris([iris.Iris(**full_iris_dict), iris.Iris(**full_iris_dict2)] * 2)
+        sql_operations.begin_read(connection)
+        page = iris_table.select(limit=2)
+        other_table.delete(where="sepal_length<200")              # Deletes a row of the page
+        assert iris_table.page_end(limit=2) == 2                    # Cursor matches the rows of the page
+        assert len(page) == 2
+        connection.rollback()
+        assert iris_table.page_end(limit=2) is None
+
+
+def test_select_cursor_columns(tmp_path):
+    pool = get_test_pool(tmp_path)
+    with pool.connection() as connection:
+        iris_table = sql_operations.SqlIrisInterface(connection=connection, create=False)
+        iris_table.insert_iris([iris.Iris(**full_iris_dict)])
+        cursor = iris_table.select_cursor(where="sepal_length>100", columns=["species"])
+        assert cursor.fetchall() == [("Iris species name",)]
+
+
+def test_summary(tmp_path):
+    pool = get_test_pool(tmp_path)
+    data = [iris.Iris(**full_iris_dict), iris.Iris(**full_iris_dict2), iris.Iris(**full_iris_dict2)]
+    with pool.connection() as connection:
+        iris_table = sql_operations.SqlIrisInterface(connection=connection, create=False)
+        iris_table.insert_iris(data)
+        summary = iris_table.summary()
+    assert summary["sepal_length"] == {
+        "type": "float",
+        "n_total_values": 3,
+        "n_unique_values": 2,
+        "minimum": 111,
+        "maximum": 1111,
+        "median": 1111}
+    assert summary["species"] == {"type": "str", "n_total_values": 3, "n_unique_values": 2}
+
+
+def test_summary_empty(tmp_path):
+    pool = get_test_pool(tmp_path)
+    with pool.connection() as connection:
+        iris_table = sql_operations.SqlIrisInterface(connection=connection, create=False)
+        summary = iris_table.summary()
+    assert summary["petal_width"] == {"type": "float", "n_total_values": 0, "n_unique_values": 0}
+
+
+def test_summary_cache(tmp_path):
+    pool = get_test_pool(tmp_path)
+    summary_cache = sql_operations.SummaryCache(columns=sql_operations.SqlIrisInterface.columns_python_types)
+    with pool.connection() as connection:
+        iris_table = sql_operations.SqlIrisInterface(connection=connection, create=False, summary_cache=summary_cache)
+        reference_table = sql_operations.SqlIrisInterface(connection=connection, create=False)
+        iris_table.insert_iris([iris.Iris(**full_iris_dict)])
+        assert iris_table.summary() == reference_table.summary()
+        iris_table.insert_iris([iris.Iris(**full_iris_dict2)] * 2)              # Applied incrementally
+        assert summary_cache._version is not None
+        assert iris_table.summary() == reference_table.summary()
+        assert iris_table.delete(where="sepal_length>200") == 2
+        assert iris_table.summary() == reference_table.summary()
+
+
+def test_summary_cache_other_writer(tmp_path):
+    pool = get_test_pool(tmp_path, max_connections=2)
+    summary_cache = sql_operations.SummaryCache(columns=sql_operations.SqlIrisInterface.columns_python_types)
+    with pool.connection() as connection, pool.connection() as other_connection:
+        iris_table = sql_operations.SqlIrisInterface(connection=connection, create=False, summary_cache=summary_cache)
+        iris_table.summary()
+        other_table = sql_operations.SqlIrisInterface(connection=other_connection, create=False)
+        other_table.insert_iris([iris.Iris(**full_iris_dict)])                  # Not seen by the cache
+        assert iris_table.summary()["species"]["n_total_values"] == 1
+
+
+def test_compile_where():
+    columns = ("petal_width", "species")
+    where_string, where_values = sql_operations.compile_where(
+        ("petal_width<1", "species IN (virginica,setosa)"), columns)
+    assert where_string == " WHERE petal_width < ? AND species IN (?,?)"
+    assert where_values == (1, "virginica", "setosa")
+
+
+def test_compile_where_cached():
+    statements = ("petal_width>2",)
+    sql_operations.compile_where(statements, ("petal_width",))
+    n_hits = sql_operations.compile_where.cache_info().hits
+    sql_operations.compile_where(statements, ("petal_width",))
+    assert sql_operations.compile_where.cache_info().hits == n_hits + 1
+
+
+def test_compile_where_unknown_column():
+    try:
+        sql_operations.compile_where(("1=1; DROP TABLE Iris; --=1",), ("petal_width",))
+    except ValueError as error:
+        assert "Unknown columns" in str(error)
+    else:
+        assert False, "ValueError not raised"
+
+
+def test_delete_all(tmp_path):
+    pool = get_test_pool(tmp_path)
+    with pool.connection() as connection:
+        iris_table = sql_operations.SqlIrisInterface(connection=connection, create=False)
+        iris_table.insert_iris([iris.Iris(**full_iris_dict), iris.Iris(**full_iris_dict2)])
+        assert iris_table.delete() == 0
+        assert iris_table.delete(where=True) == 2
+
+
+def test_secondary_indexes(tmp_path):
+    pool = sql_operations.ConnectionPool(
+        path=str(tmp_path / "iris.sql"),
+        bootstrap=lambda connection: sql_operations.SqlIrisInterface.bootstrap(connection, ["species"]))
+    with pool.connection() as connection:
+        query_plan = sql_operations.explain_query_plan("Iris", connection, (" WHERE species = ?", ["a"]))
+        assert "Iris_species" in query_plan[0]
+        query_plan = sql_operations.explain_query_plan("Iris", connection, (" WHERE petal_width < ?", [1]))
+        assert "SCAN" in query_plan[0]
+
+
+def test_no_duplicate_index(tmp_path):
+    pool = sql_operations.ConnectionPool(
+        path=str(tmp_path / "iris.sql"),
+        bootstrap=lambda connection: sql_operations.SqlIrisInterface.bootstrap(connection, ["sepal_length", "species"]))
+    with pool.connection() as connection:
+        indexes = {row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'Iris';")}
+        assert indexes == {"Iris_content", "Iris_species"}
+        query_plan = sql_operations.explain_query_plan("Iris", connection, (" WHERE sepal_length < ?", [1]))
+        assert "Iris_content" in query_plan[0]
+
+
+def test_query_advisor(tmp_path, caplog):
+    caplog.set_level("INFO")
+    pool = get_test_pool(tmp_path)
+    query_advisor = sql_operations.QueryAdvisor(slow_query_seconds=0, report_interval=2)
+    with pool.connection() as connection:
+        iris_table = sql_operations.SqlIrisInterface(connection=connection, create=False, query_advisor=query_advisor)
+        iris_table.select(where=["species=a", "petal_width<1"])
+        iris_table.delete(where="species=a")
+    assert query_advisor.column_usage == {"species": 2, "petal_width": 1}
+    assert "Slow query" in caplog.text
+    assert "USING INDEX" in caplog.text
+    assert "species: 2" in caplog.text
+
+
+def test_sync_source_cleared_on_delete(tmp_path):
+    pool = get_test_pool(tmp_path)
+    with pool.connection() as connection:
+        iris_table = sql_operations.SqlIrisInterface(connection=connection, create=False)
+        sql_operations.save_sync_source("http://iris.csv", connection, etag='"1"')
+        assert sql_operations.get_sync_source("http://iris.csv", connection)["etag"] == '"1"'
+        iris_table.insert_iris([iris.Iris(**full_iris_dict)])
+        iris_table.delete(where="sepal_length>1000")                # Nothing deleted
+        assert sql_operations.get_sync_source("http://iris.csv", connection) is not None
+        iris_table.delete(where=True)
+        assert sql_operations.get_sync_source("http://iris.csv", connection) is None
+
+
+def test_pool_uses_wal(tmp_path):
+    pool = get_test_pool(tmp_path, pragmas=sql_operations.get_pragmas(synchronous="FULL"))
+    with pool.connection() as connection:
+        assert connection.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
+        assert connection.execute("PRAGMA synchronous;").fetchone()[0] == 2                 # FULL
+
+
+def test_query_result_cache():
+    result_cache = sql_operations.QueryResultCache(max_entries=2, ttl_seconds=60)
+    assert result_cache.get(("a",), version=1) is None
+    result = result_cache.put(("a",), version=1, body=b"[]", next_cursor=5)
+    assert result_cache.get(("a",), version=1) is result
+    assert result.next_cursor == 5
+    assert result_cache.get(("a",), version=2) is None                   # Table changed
+    result_cache.put(("a",), version=2, body=b"[1]")
+    result_cache.put(("b",), version=2, body=b"[2]")
+    result_cache.get(("a",), version=2)                                  # "b" is now least recently used
+    result_cache.put(("c",), version=2, body=b"[3]")
+    assert result_cache.get(("b",), version=2) is None
+    assert result_cache.get(("a",), version=2).body == b"[1]"
+    stats = result_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["invalidated"], stats["evicted"]) == (3, 3, 1, 1)
+    assert (stats["entries"], stats["bytes"]) == (2, 6)
+
+
+def test_query_result_cache_expired():
+    result_cache = sql_operations.QueryResultCache(ttl_seconds=0)
+    result = result_cache.put(("a",), version=1, body=b"[]")
+    assert result_cache.get(("a",), version=1) is None
+    assert result_cache.stats()["expired"] == 1
+    disabled_cache = sql_operations.QueryResultCache(max_entries=0)
+    assert disabled_cache.put(("a",), version=1, body=b"[]").etag == result.etag
+    assert disabled_cache.stats()["entries"] == 0
+
+
+def test_delete_chunked(tmp_path):
+    pool = get_test_pool(tmp_path)
+    with pool.connection() as connection:
+        iris_table = sql_operations.SqlIrisInterface(connection=connection, create=False)
+        iris_table.insert_iris([iris.Iris(**full_iris_dict), iris.Iris(**full_iris_dict2)] * 10)
+        version = iris_table.version()
+        stats = sql_operations.DeleteStats()
+        assert iris_table.delete_chunked(where="sepal_length<1000", chunk_size=3, stats=stats) == 10
+        assert (stats.n_rows_deleted, stats.n_chunks) == (10, 4)
+        assert iris_table.version() == version + 10
+        assert len(iris_table.select(where="sepal_length<1000")) == 0
+        assert iris_table.delete_chunked() == 0                                  # No action without "where"
+        assert iris_table.delete_chunked(where=True, chunk_size=5) == 10
+        assert iris_table.select() == []
+
+
+def test_write_queue_group_commit(tmp_path):
+    pool = get_test_pool(tmp_path, max_connections=1)
+    write_queue = sql_operations.WriteQueue(
+        connection_pool=pool,
+        get_table=lambda connection: sql_operations.SqlIrisInterface(connection=connection, create=False))
+    with pool.connection() as connection:               # Writer waits for the connection, while batches queue up
+        futures = [write_queue.submit([iris.Iris(**full_iris_dict)] * 2)]
+        for _ in range(500):                            # Wait until the writer has taken the first batch
+            if write_queue.stats()["queued_batches"] == 0:
+                break
+            time.sleep(0.01)
+        time.sleep(0.05)                                # Writer is now waiting for the connection
+        futures += [write_queue.submit([iris.Iris(**full_iris_dict)] * 2) for _ in range(4)]
+        futures += [write_queue.submit([iris.Iris(**full_iris_dict)], unique=True)]
+    assert [future.result(timeout=5) for future in futures] == [2] * 5 + [0]
+    write_queue.close()
+    stats = write_queue.stats()
+    assert (stats["batches"], stats["rows_inserted"]) == (6, 10)
+    assert (stats["transactions"], stats["max_batches_per_transaction"]) == (2, 5)
+    with pool.connection() as connection:
+        assert len(sql_operations.SqlIrisInterface(connection=connection, create=False).select()) == 10
+
+
+def test_write_queue_failed(tmp_path):
+    pool = get_test_pool(tmp_path)
+
+    def get_table(connection):
+        raise sqlite3.OperationalError("database is locked")
+
+    write_queue = sql_operations.WriteQueue(connection_pool=pool, get_table=get_table)
+    future = write_queue.submit([iris.Iris(**full_iris_dict)])
+    assert isinstance(future.exception(timeout=5), sqlite3.OperationalError)
+    write_queue.close()
+
+
+def test_write_queue_close_while_submitting(tmp_path):
+    pool = get_test_pool(tmp_path)
+    write_queue = sql_operations.WriteQueue(
+        connection_pool=pool,
+        get_table=lambda connection: sql_operations.SqlIrisInterface(connection=connection, create=False),
+        max_queued_batches=2)
+    futures = list()
+    started = threading.Barrier(5)
+
+    def submit():
+        started.wait()
+        while True:
+            try:
+                futures.append(write_queue.submit([iris.Iris(**full_iris_dict)]))
+            except RuntimeError:                        # Closed
+                return
+
+    threads = [threading.Thread(target=submit) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    started.wait()
+    write_queue.close()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert all(future.result(timeout=5) == 1 for future in futures)     # Every accepted batch is written
+    assert write_queue.stats()["rows_inserted"] == len(futures)
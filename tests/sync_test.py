@@ -0,0 +1,107 @@
+# standard
+import functools
+import http.server
+import threading
+# local
+import sync
+
+iris_csv = """\
+sepal_length,sepal_width,petal_length,petal_width,species
+111,222,333,444,Iris species name
+"""
+
+
+def serve_directory(directory) -> http.server.ThreadingHTTPServer:
+    """Serve files from a directory on a free local port, in a background thread."""
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(directory))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_request_if_changed(tmp_path):
+    (tmp_path / "iris.csv").write_text(iris_csv)
+    server = serve_directory(tmp_path)
+    url = f"http://127.0.0.1:{server.server_address[1]}/iris.csv"
+    try:
+        with sync.create_session() as session:
+            with sync.request_if_changed(url, session) as response:
+                download = sync.Download(response, sync.SyncStats())
+                assert "".join(download.iter_lines()) == iris_csv
+            assert download.last_modified is not None
+            assert download.stats.n_bytes_downloaded == len(iris_csv)
+            sync_source = {"last_modified": download.last_modified}
+            assert sync.request_if_changed(url, session, sync_source) is None           # 304 Not Modified
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class FakeResponse:
+    """Stand-in for a streamed requests Response"""
+    def __init__(self, chunks: list[bytes], headers: dict = None) -> None:
+        self.chunks = chunks
+        self.headers = headers or dict()
+
+    def iter_content(self, chunk_size: int):
+        return iter(self.chunks)
+
+
+def test_download_lines_split_between_chunks():
+    content = "a,b\r\nõ,2\r\n3,4".encode()
+    chunks = [content[i:i + 3] for i in range(0, len(content), 3)]
+    download = sync.Download(FakeResponse(chunks), sync.SyncStats())
+    assert list(download.iter_lines()) == ["a,b\r\n", "õ,2\r\n", "3,4"]
+
+
+def test_download_decoded_strictly():
+    download = sync.Download(FakeResponse(["õ\n".encode("latin-1")]), sync.SyncStats())
+    try:
+        list(download.iter_lines())
+    except UnicodeDecodeError:
+        pass
+    else:
+        assert False, "UnicodeDecodeError not raised"
+    latin_response = FakeResponse(["õ\n".encode("latin-1")], headers={"Content-Type": 'text/csv; charset="latin-1"'})
+    assert list(sync.Download(latin_response, sync.SyncStats()).iter_lines()) == ["õ\n"]
+
+
+def test_csv_download_batches():
+    download = sync.Download(FakeResponse([iris_csv.encode()] + [b"1,2,3,4,a\n"] * 4), sync.SyncStats())
+    iris_batches = list(sync.iter_csv_download(download, batch_size=2))
+    assert [len(iris_batch) for iris_batch in iris_batches] == [2, 2, 1]
+    assert download.stats.n_rows_parsed == 5
+
+
+def test_fetch_concurrently():
+    def items(n_items: int):
+        yield from range(n_items)
+        if n_items == 3:
+            raise ValueError("bad item")
+
+    producers = {f"http://host{n_items % 2}/{n_items}": functools.partial(items, n_items) for n_items in range(1, 5)}
+    events = list(sync.fetch_concurrently(producers, host_limiter=sync.HostLimiter(max_per_host=1), max_workers=4))
+    items_per_url = {url: [item for event_url, item, _ in events if event_url == url and item is not None]
+                     for url in producers}
+    assert items_per_url == {url: list(range(int(url[-1]))) for url in producers}
+    errors = {url: exception for url, item, exception in events if item is None and exception is not None}
+    assert list(errors) == ["http://host1/3"]
+    assert len([event for event in events if event[1] is None]) == 4            # One end event per url
+
+
+def test_host_limiter():
+    host_limiter = sync.HostLimiter(max_per_host=1)
+    with host_limiter.limit("http://host/a.csv"):
+        acquired = threading.Event()
+
+        def download():
+            with host_limiter.limit("http://HOST/b.csv"):
+                acquired.set()
+
+        thread = threading.Thread(target=download)
+        thread.start()
+        assert not acquired.wait(timeout=0.2)
+        with host_limiter.limit("http://other/a.csv"):              # Other hosts aren't limited
+            pass
+    thread.join()
+    assert acquired.is_set()